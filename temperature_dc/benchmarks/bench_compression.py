@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Compression ratio and worst reconstruction error of report.SwingingDoor on temperature traces.
+# Traces are CSV (timestamp,value columns) or JSONL (one reading per line with "timestamp" and "temp"), with
+# timestamps as epoch seconds or ISO 8601 - e.g. readings exported from InfluxDB. Without any, synthetic traces are used.
+#
+# usage (from temperature_dc/): python benchmarks/bench_compression.py [trace ...] [--dev 0.1 0.25 0.5 1]
+
+import argparse
+import bisect
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from report import SwingingDoor
+from traces import load_trace
+
+
+def synthetic_traces(n=86400):
+    rng = random.Random(1)
+    steady = [(t, 21.0 + rng.gauss(0, 0.05)) for t in range(n)]
+    oven = []
+    for t in range(n):
+        phase = t % 14400  # 4h cycle: 1h ramp to 200C, 2h hold, 1h cool
+        if phase < 3600:
+            value = 20 + 180 * phase / 3600
+        elif phase < 10800:
+            value = 200 + 1.5 * math.sin(phase / 300)
+        else:
+            value = 200 - 180 * (phase - 10800) / 3600
+        oven.append((t, value + rng.gauss(0, 0.2)))
+    ambient = [(t, 18 + 4 * math.sin(2 * math.pi * t / 86400) + rng.gauss(0, 0.1)) for t in range(n)]
+    return {"steady": steady, "oven_cycle": oven, "ambient_daily": ambient}
+
+
+def compress(points, deviation):
+    door = SwingingDoor(deviation)
+    kept = []
+    for t, value in points:
+        kept += door.feed(t, value, (t, value))
+    kept += door.flush()
+    return kept
+
+
+def max_error(points, kept):
+    times = [t for t, _ in kept]
+    worst = 0.0
+    for t, value in points:
+        i = bisect.bisect_right(times, t) - 1
+        t0, v0 = kept[i]
+        if t0 == t or i + 1 == len(kept):
+            reconstructed = v0
+        else:
+            t1, v1 = kept[i + 1]
+            reconstructed = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+        worst = max(worst, abs(reconstructed - value))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="swinging door compression benchmark")
+    parser.add_argument("traces", nargs="*", help="CSV or JSONL trace files")
+    parser.add_argument("--dev", type=float, nargs="+", default=[0.1, 0.25, 0.5, 1.0])
+    args = parser.parse_args()
+
+    traces = {os.path.basename(path): load_trace(path) for path in args.traces} or synthetic_traces()
+
+    print(f"{'trace':<24}{'dev':>6}{'points':>10}{'kept':>8}{'ratio':>9}{'max err':>10}")
+    for name, points in traces.items():
+        for deviation in args.dev:
+            kept = compress(points, deviation)
+            print(f"{name:<24}{deviation:>6g}{len(points):>10}{len(kept):>8}{len(points) / len(kept):>8.1f}x"
+                  f"{max_error(points, kept):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Cost of converting a cycle's RTD resistances to temperatures: the per-sample scalar code (PT_RTD's quadratic
+# inversion as it was, and the Sequent HAT's poly5 one channel at a time) against linearise.RTDTable, one value at a
+# time and as a batch (numpy.interp when numpy is installed). Also reports each method's worst error against the
+# exact Callendar-Van Dusen inversion over the PT100 range, where the quadratic is off below 0 C.
+#
+# usage (from temperature_dc/): python benchmarks/bench_linearise.py [--channels N] [--repeat N]
+
+import argparse
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import linearise
+from adc.rtd_cards import poly5
+
+
+def quadratic_before(resistance, R_0dC=100, a=3.9083e-3, b=-5.775e-7):
+    # adc.MAX31865.PT_RTD.calculate_temperature_quadratic before the coefficients were precomputed
+    return (-a + math.sqrt((a ** 2) - 4 * b * (1 - (resistance / R_0dC)))) / (2 * b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTD linearisation microbenchmark")
+    parser.add_argument("--channels", type=int, default=256, help="resistances converted per cycle")
+    parser.add_argument("--repeat", type=int, default=200, help="cycles per timing run")
+    args = parser.parse_args()
+
+    table = linearise.rtd_table(100)
+    rng = random.Random(1)
+    resistances = [linearise.cvd_resistance(rng.uniform(-200, 850)) for _ in range(args.channels)]
+
+    methods = {
+        "quadratic (scalar)": lambda: [quadratic_before(r) for r in resistances],
+        "poly5 (scalar)": lambda: [poly5(r) for r in resistances],
+        "table (scalar)": lambda: [table.temperature(r) for r in resistances],
+        "table (batch)": lambda: table.temperatures(resistances),
+    }
+    try:
+        import numpy
+        print(f"numpy {numpy.__version__}: batch uses numpy.interp")
+    except ImportError:
+        print("numpy not installed: batch falls back to the scalar table")
+
+    results = {}
+    for name, fn in methods.items():
+        best = min(timeit.repeat(fn, number=args.repeat, repeat=5)) / args.repeat
+        results[name] = best
+        print(f"{name:>20}: {best * 1e6:9.1f} us/cycle  {best / args.channels * 1e9:8.1f} ns/channel")
+    print(f"{'speedup':>20}: {results['quadratic (scalar)'] / results['table (batch)']:9.1f}x "
+          f"(batch table vs scalar quadratic, {args.channels} channels)")
+
+    # accuracy against the exact inversion, every 0.1 C over the range
+    temps = [-200 + i * 0.1 for i in range(10501)]
+    rs = [linearise.cvd_resistance(t) for t in temps]
+    exact = [linearise.cvd_temperature(r) for r in rs]
+    for name, convert in (("quadratic", quadratic_before), ("poly5", poly5), ("table", table.temperature)):
+        below = max(abs(convert(r) - t) for r, t in zip(rs, exact) if t < 0)
+        above = max(abs(convert(r) - t) for r, t in zip(rs, exact) if t >= 0)
+        print(f"{name:>20}: max error {below:8.4f} C below 0 C, {above:8.4f} C above")
+
+
+if __name__ == "__main__":
+    main()
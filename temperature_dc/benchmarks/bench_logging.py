@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# CPU spent on logging per published sample: the per-sample logging measure used to do (driver "started" line,
+# "STAGE-3 done", print of the average, temperature_reading and the dispatched payload, all at INFO, with
+# main.measure's extra StreamHandler duplicating each line) against the current calls, which are DEBUG with lazy
+# arguments under logging_setup's INFO level. Log output goes to /dev/null, so this is a lower bound on the saving
+# when the lines end up in Docker's json-file logs.
+#
+# usage (from temperature_dc/): python benchmarks/bench_logging.py [--samples N] [--channels N] [--rate HZ]
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import logging_setup
+
+
+def make_payload(i):
+    return {"machine": "Machine_1", "temp": 21.5, "AlertVal": 0, "ThresholdLow": 25.0, "ThresholdHigh": 30.0,
+            "sensor": "PT100_raspi_SMHAT", "channel": f"channel_{i}", "temp_min": 21.4, "temp_max": 21.6,
+            "temp_stddev": 0.05, "count": 1, "missed": 0, "timestamp": datetime.datetime.now().isoformat()}
+
+
+def before(samples, devnull):
+    logging.basicConfig(level=logging.INFO, format=logging_setup.FORMAT, stream=devnull, force=True)
+    logger = logging.getLogger("main.measure")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(devnull))
+    sensor_logger = logging.getLogger("main.measure.sensor")
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        start = time.process_time()
+        for i in range(samples):
+            payload = make_payload(i % 24)
+            sensor_logger.info("TemperatureMeasureBuildingBlock- PT100_raspi_sequentmicrosystems_HAT started")
+            logger.info("Prorcess TemperatureMeasureBuildingBlock- STAGE-3 done")
+            print(payload["temp"])
+            logger.info(f"temperature_reading {payload['channel']}: {payload['temp']}")
+            logger.info(f"dispatch to { payload['channel']} of {payload}")
+        return time.process_time() - start
+    finally:
+        sys.stdout = stdout
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+
+def after(samples, devnull):
+    logging_setup.configure({"logging": {"level": "INFO"}})
+    logging.getLogger().handlers[0].setStream(devnull)
+    logger = logging.getLogger("main.measure")
+    logger.setLevel(logging.NOTSET)
+    start = time.process_time()
+    for i in range(samples):
+        payload = make_payload(i % 24)
+        logger.debug("temperature_reading %s: %s", payload['channel'], payload['temp'])
+        logger.debug("dispatch to %s of %s", payload['channel'], payload)
+    return time.process_time() - start
+
+
+def baseline(samples):
+    # building the payload is in both loops, take it out of the comparison
+    start = time.process_time()
+    for i in range(samples):
+        make_payload(i % 24)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-sample logging cost")
+    parser.add_argument("--samples", type=int, default=50000)
+    parser.add_argument("--channels", type=int, default=24, help="for the CPU share estimate")
+    parser.add_argument("--rate", type=float, default=10, help="samples per second per channel, for the estimate")
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull:
+        base = min(baseline(args.samples) for _ in range(3))
+        old = min(before(args.samples, devnull) for _ in range(3)) - base
+        new = min(after(args.samples, devnull) for _ in range(3)) - base
+
+    per_second = args.channels * args.rate
+    for name, cpu in (("before", old), ("after", new)):
+        per_sample = max(cpu, 0.0) / args.samples  # "after" is within timing noise of the baseline
+        print(f"{name:>7}: {per_sample * 1e6:8.2f} us CPU per sample, "
+              f"{per_sample * per_second * 100:6.2f}% of a core at {args.channels} channels x {args.rate:g} Hz")
+    print(f"  saved: {(old - new) / args.samples * 1e6:8.2f} us CPU per sample")
+
+
+if __name__ == "__main__":
+    main()
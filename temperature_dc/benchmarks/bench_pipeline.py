@@ -0,0 +1,193 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# End-to-end throughput benchmark: runs the real measure and wrapper building blocks (as created by
+# main.create_building_blocks) with Simulated channels, publishing to a local stand-in broker, and sweeps channel
+# count, sample interval and payload size. For each run it reports readings/s delivered, p50/p99 latency from
+# reading timestamp to arrival at the broker, and CPU% / RSS of the two building block processes.
+#
+# usage (from temperature_dc/): python benchmarks/bench_pipeline.py [--channels 1 10 100] [--intervals 1 0.1]
+#                               [--payload 0 1024] [--duration 10] [--output pipeline_results.json]
+
+import argparse
+import copy
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import tomli
+import main
+from stand_in_broker import StandInBroker
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+
+
+def rss_bytes(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_config(base, broker, args, channels, interval, payload, run):
+    config = copy.deepcopy(base)
+    config['sensing'] = {'channels': [{'name': f"sim_{i}", 'adc': "Simulated", 'seed': i,
+                                       'tags': {'pad': "x" * payload} if payload else {}}
+                                      for i in range(channels)]}
+    config['sampling'] = {**config.get('sampling', {}), 'sample_count': 1, 'sample_interval': interval}
+    config['sampling'].pop('window', None)
+    config.pop('reporting', None)
+    config['mqtt'] = {**config['mqtt'], 'broker': broker.host, 'port': broker.port, 'loop_mode': args.loop_mode,
+                      'batch': {'max_messages': args.batch, 'max_linger': args.linger},
+                      'buffer': {'enabled': False}, 'latency_report_interval': 3600}
+    config['mqtt']['reconnect'] = {**config['mqtt']['reconnect'], 'initial': 0.1}
+    config['ipc'] = {**config.get('ipc', {}), 'path': f"/tmp/bench_pipeline_{os.getpid()}_{run}.ipc"}
+    if args.codec:
+        config['ipc']['codec'] = args.codec
+    return config
+
+
+def run_once(config, broker, args):
+    bbs = main.create_building_blocks(config)
+
+    # building blocks print/log every reading - keep that out of the benchmark's output
+    stdout, stderr = os.dup(1), os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    try:
+        main.start_building_blocks(bbs)
+    finally:
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        os.close(devnull)
+
+    try:
+        time.sleep(args.warmup)
+        broker.take()
+        cpu_start = {key: cpu_seconds(bb.pid) for key, bb in bbs.items()}
+        start = time.time()
+        time.sleep(args.duration)
+        elapsed = time.time() - start
+        cpu = {key: (cpu_seconds(bb.pid) - cpu_start[key]) / elapsed * 100 for key, bb in bbs.items()}
+        rss = {key: rss_bytes(bb.pid) for key, bb in bbs.items()}
+        messages = broker.take()
+    finally:
+        for bb in bbs.values():
+            bb.terminate()
+            bb.join()
+
+    readings = 0
+    latencies = []
+    payload_bytes = 0
+    for arrived, _topic, payload in messages:
+        payload_bytes += len(payload)
+        decoded = json.loads(payload)
+        for reading in decoded if isinstance(decoded, list) else [decoded]:
+            readings += 1
+            latencies.append(arrived - datetime.datetime.fromisoformat(reading['timestamp']).timestamp())
+
+    return {"readings_per_s": readings / elapsed,
+            "messages_per_s": len(messages) / elapsed,
+            "payload_bytes_per_s": payload_bytes / elapsed,
+            "latency_p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+            "latency_p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+            "cpu_percent": cpu,
+            "rss_bytes": rss}
+
+
+def benchmark():
+    parser = argparse.ArgumentParser(description="measure -> wrapper -> MQTT pipeline benchmark")
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--intervals", type=float, nargs="+", default=[1.0, 0.1], help="sample_interval values (s)")
+    parser.add_argument("--payload", type=int, nargs="+", default=[0, 1024], help="bytes of padding per reading")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds before measuring each run")
+    parser.add_argument("--loop-mode", default="poll", choices=["poll", "threaded"])
+    parser.add_argument("--codec", choices=["json", "msgpack"], help="IPC codec (default: as in config.toml)")
+    parser.add_argument("--batch", type=int, default=1, help="[mqtt] batch.max_messages")
+    parser.add_argument("--linger", type=float, default=0.5, help="[mqtt] batch.max_linger")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(__file__), "..", "config", "config.toml"))
+    parser.add_argument("--output", default="pipeline_results.json")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with open(args.config, "rb") as f:
+        base = tomli.load(f)
+
+    broker = StandInBroker()
+    results = []
+    run = 0
+    print(f"{'channels':>8}{'interval':>9}{'payload':>8}{'readings/s':>12}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'measure cpu%':>13}{'wrapper cpu%':>13}{'measure MB':>11}{'wrapper MB':>11}")
+    for channels in args.channels:
+        for interval in args.intervals:
+            for payload in args.payload:
+                config = make_config(base, broker, args, channels, interval, payload, run)
+                result = run_once(config, broker, args)
+                run += 1
+                result.update(channels=channels, sample_interval=interval, payload_padding=payload,
+                              expected_readings_per_s=channels / interval)
+                results.append(result)
+                print(f"{channels:>8}{interval:>9g}{payload:>8}{result['readings_per_s']:>12.1f}"
+                      f"{result['latency_p50_ms'] or float('nan'):>9.1f}{result['latency_p99_ms'] or float('nan'):>9.1f}"
+                      f"{result['cpu_percent']['measure']:>13.1f}{result['cpu_percent']['wrapper']:>13.1f}"
+                      f"{result['rss_bytes']['measure'] / 1e6:>11.1f}{result['rss_bytes']['wrapper'] / 1e6:>11.1f}")
+    broker.close()
+
+    with open(args.output, "w") as f:
+        json.dump({"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                   "platform": platform.platform(), "python": platform.python_version(),
+                   "settings": {"duration": args.duration, "loop_mode": args.loop_mode, "codec": args.codec,
+                                "batch": args.batch, "linger": args.linger},
+                   "results": results}, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    benchmark()
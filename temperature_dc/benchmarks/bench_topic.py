@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Per-message cost of rendering the MQTT topic in the wrapper: the original chevron.render(urljoin(...)) on a
+# merged payload/constants dict against the compiled, cached topic.TopicRenderer. Checks first that both render
+# the same topics.
+#
+# usage (from temperature_dc/): python benchmarks/bench_topic.py [--channels N] [--number N]
+
+import argparse
+import os
+import sys
+import timeit
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import chevron
+from topic import TopicRenderer
+
+
+def make_messages(channels):
+    return [{"path": f"channel_{i}",
+             "payload": {"machine": "Machine_1", "temp": 21.5 + i, "AlertVal": 0, "ThresholdLow": 25.0,
+                         "ThresholdHigh": 30.0, "sensor": "PT100_raspi_SMHAT", "channel": f"channel_{i}",
+                         "timestamp": "2023-01-01T00:00:00.000000+00:00"}}
+            for i in range(channels)]
+
+
+# templates and payload values that must render exactly as chevron does, whether or not they take the fast path
+CHECK_TEMPLATES = ["t/{{machine}}", "t/{{ machine }}/{{sensor}}", "t/{{{machine}}}", "t/{{&machine}}",
+                   "t/{{#machine}}x{{/machine}}", "t/{{machine}}}", "t/{{{{machine}}", "t/{x}/{{machine}}"]
+CHECK_VALUES = ["M&1", "<b>", "", None, 0, 0.0, False, True, [], {}, [1, 2], {"a": 1}, 21.5]
+
+
+def check():
+    for template in CHECK_TEMPLATES:
+        for value in CHECK_VALUES:
+            renderer = TopicRenderer(template, {})
+            payload = {"machine": value, "sensor": value}
+            expected = chevron.render(template, payload)
+            rendered = renderer.render("", payload)
+            assert rendered == expected, f"{template} with {value!r}: {rendered!r} != chevron {expected!r}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT topic rendering microbenchmark")
+    parser.add_argument("--channels", type=int, default=24)
+    parser.add_argument("--number", type=int, default=20000, help="messages rendered per timing run")
+    parser.add_argument("--template", default="temperature_monitoring/{{machine}}")
+    args = parser.parse_args()
+
+    constants = {"machine": "Machine_1"}
+    messages = make_messages(args.channels)
+    renderer = TopicRenderer(args.template, constants)
+
+    def before():
+        for i in range(args.number):
+            msg = messages[i % len(messages)]
+            chevron.render(urljoin(args.template + "/", msg["path"]), {**msg["payload"], **constants})
+
+    def after():
+        for i in range(args.number):
+            msg = messages[i % len(messages)]
+            renderer.render(msg["path"], msg["payload"])
+
+    check()
+    for msg in messages:
+        expected = chevron.render(urljoin(args.template + "/", msg["path"]), {**msg["payload"], **constants})
+        assert renderer.render(msg["path"], msg["payload"]) == expected
+
+    results = {}
+    for name, fn in (("chevron", before), ("compiled", after)):
+        best = min(timeit.repeat(fn, number=1, repeat=5))
+        results[name] = best / args.number * 1e6
+        print(f"{name:>9}: {results[name]:8.2f} us/message")
+    print(f"  speedup: {results['chevron'] / results['compiled']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Minimal MQTT 3.1.1 broker for benchmarks: accepts connections, acknowledges CONNECT/PINGREQ/QoS 1 PUBLISH and
+# records every PUBLISH it receives with its arrival time. It does not forward messages to subscribers.
+
+import socket
+import struct
+import threading
+import time
+
+
+class StandInBroker:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()
+
+        self.messages = []  # (arrival time, topic, payload bytes)
+        self.bytes_received = 0
+        self.connections = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    @staticmethod
+    def recv_exactly(connection, n):
+        data = b""
+        while len(data) < n:
+            chunk = connection.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def serve(self, connection):
+        try:
+            while True:
+                header = self.recv_exactly(connection, 1)[0]
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = self.recv_exactly(connection, 1)[0]
+                    length += (byte & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self.recv_exactly(connection, length) if length else b""
+                packet_type = header >> 4
+                if packet_type == 1:  # CONNECT
+                    connection.sendall(b"\x20\x02\x00\x00")
+                elif packet_type == 3:  # PUBLISH
+                    arrived = time.time()
+                    qos = (header >> 1) & 0x03
+                    topic_length = struct.unpack(">H", body[:2])[0]
+                    topic = body[2:2 + topic_length].decode("utf8")
+                    position = 2 + topic_length
+                    if qos:
+                        connection.sendall(b"\x40\x02" + body[position:position + 2])  # PUBACK
+                        position += 2
+                    with self.lock:
+                        self.messages.append((arrived, topic, body[position:]))
+                        self.bytes_received += 2 + length
+                elif packet_type == 12:  # PINGREQ
+                    connection.sendall(b"\xd0\x00")
+                elif packet_type == 14:  # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        connection.close()
+
+    def take(self):
+        """messages received since the last call"""
+        with self.lock:
+            messages = self.messages
+            self.messages = []
+        return messages
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+                connection.close()
+            except OSError:
+                pass
@@ -36,17 +36,57 @@ class max31865:
 	REG_CONFIG_READ = 0x00
 	REG_CONFIG_WRITE = 0x80
 	REG_RTD_READING = 0x01
+	REG_FAULT_STATUS = 0x07
 
+	# Fault status register bits
+	FAULT_HIGH_THRESHOLD = 0x80
+	FAULT_LOW_THRESHOLD = 0x40
+	FAULT_REFIN_HIGH = 0x20
+	FAULT_REFIN_LOW = 0x10
+	FAULT_RTDIN_LOW = 0x08
+	FAULT_VOLTAGE = 0x04
 
-	def __init__(self, R_Ref=438, spi_bus=0, spi_cs=0, spi_speed=7629, spi_clock_polarity=1, spi_clock_phase=1):
+	# Continuous conversion period with the 50Hz / 60Hz filter (datasheet: 20ms / 16.7ms)
+	CONVERSION_PERIOD = {1: 0.020, 0: 0.0167}
+
+	# (spi_bus, spi_cs) -> True if boards on that spidev device use GPIO chip selects, False for the hardware one.
+	# no_cs is a setting of the device, not of one open handle, so the two can't share a device.
+	devices = {}
+
+
+	def __init__(self, R_Ref=438, spi_bus=0, spi_cs=0, spi_speed=7629, spi_clock_polarity=1, spi_clock_phase=1, cs_pin=None, drdy_pin=None):
 
 		self.R_Ref = R_Ref	# ADC full scale. Ideally around 4*R_0dC. Our board's resistor is marked 431 => 430 ohms, but measuring it suggests 438.
 
+		gpio_cs = cs_pin is not None
+		if self.devices.setdefault((spi_bus, spi_cs), gpio_cs) != gpio_cs:
+			raise Exception(f'MAX31865 boards with cs_pin need a spi_cs of their own: spidev{spi_bus}.{spi_cs} is '
+							f'already used with {"GPIO" if not gpio_cs else "its hardware"} chip select')
+
 		self.spi = spidev.SpiDev()
 		self.spi.open(spi_bus, spi_cs)
 		self.spi.max_speed_hz = spi_speed
 		self.spi.mode = (spi_clock_polarity << 1 | spi_clock_phase)	# 0b11 or else...
 
+		# Boards beyond the hardware chip selects can each use a GPIO pin as CS, and DRDY (low while a new
+		# conversion is waiting to be read) can be wired to a GPIO pin so reads only touch the bus when there is one.
+		self.cs_pin = cs_pin
+		self.drdy_pin = drdy_pin
+		if cs_pin is not None or drdy_pin is not None:
+			import RPi.GPIO as GPIO
+			self.GPIO = GPIO
+			GPIO.setmode(GPIO.BCM)
+			GPIO.setwarnings(False)
+			if cs_pin is not None:
+				self.spi.no_cs = True
+				GPIO.setup(cs_pin, GPIO.OUT, initial=GPIO.HIGH)
+			if drdy_pin is not None:
+				GPIO.setup(drdy_pin, GPIO.IN)
+
+		self.conversion_period = self.CONVERSION_PERIOD[1]
+		self.last_burst = None
+		self.last_read = None
+
 
 	def __call__(self):
 		return self.calculate_resistance(self._read_adc())
@@ -67,13 +107,21 @@ class max31865:
 		07h = Fault Status
 		"""
 
+		if self.cs_pin is not None:
+			self.GPIO.output(self.cs_pin, self.GPIO.LOW)
 		resp = self.spi.xfer2([first_reg_addr] + [0]*nregs)[1:] # Ignore first byte as it was while the command was being clocked in
+		if self.cs_pin is not None:
+			self.GPIO.output(self.cs_pin, self.GPIO.HIGH)
 		return resp
 
 
 	def _write_reg(self, reg_addr, data):
+		if self.cs_pin is not None:
+			self.GPIO.output(self.cs_pin, self.GPIO.LOW)
 		self.spi.writebytes([reg_addr, data])			# Can be temperamental and cause seg faults, but behaving today.
 #		self.spi.xfer2([reg_addr, data])			# More reliable, even when discarding the response.
+		if self.cs_pin is not None:
+			self.GPIO.output(self.cs_pin, self.GPIO.HIGH)
 
 
 	def _bytes_to_15bit(self, MSBs_byte, LSBs_byte):
@@ -104,6 +152,35 @@ class max31865:
 
 		new_config_byte = (VBias << 7 | continous << 6 | oneshot << 5 | threewire << 4 | faultdetect << 2 | faultclear << 1 | filter50Hz)
 		self._write_reg(self.REG_CONFIG_WRITE, new_config_byte)
+		self.conversion_period = self.CONVERSION_PERIOD[filter50Hz]
+
+
+	def read_all(self):
+		"""
+		Read all 8 registers in one burst and return (adc_code, fault_status). fault_status is 0 when the RTD
+		reading's fault bit is clear, otherwise the fault status register (see FAULT_*), which is then cleared.
+
+		In continuous mode a new conversion is only ready every conversion period (or when DRDY is low), so
+		until then the previous result is returned without another transfer.
+		"""
+		now = time.monotonic()
+		if self.last_read is not None:
+			if self.drdy_pin is not None:
+				if self.GPIO.input(self.drdy_pin):
+					return self.last_read
+			elif now - self.last_burst < self.conversion_period:
+				return self.last_read
+
+		regs = self._read_regs(self.REG_CONFIG_READ, 8)
+		self.last_burst = now
+		adc_code = self._bytes_to_15bit(regs[1], regs[2])
+		fault_status = 0
+		if regs[2] & 0x01:
+			fault_status = regs[self.REG_FAULT_STATUS] or 0x01
+			# clear the fault: D1 set with D5, D3 and D2 written as 0, the rest of the config kept
+			self._write_reg(self.REG_CONFIG_WRITE, (regs[0] & ~0b00101100) | 0b00000010)
+		self.last_read = (adc_code, fault_status)
+		return self.last_read
 
 
 	def oneshot(self):
@@ -134,16 +211,24 @@ class PT_RTD:
 		self.c_pos = c_pos	# For temperatures above 0 degrees C
 		self.c_neg = c_neg	# For temperatures below 0 degrees C
 
+		# Terms of the inversions that only depend on the constants, worked out once rather than per reading
+		self._inv_R_0dC = 1 / R_0dC
+		self._inv_a = 1 / a
+		self._a_squared = a * a
+		self._4b = 4 * b
+		self._inv_2b = 1 / (2 * b)
+		self._table = None
+
 
 	def __call__(self, resistance):
 		"""shorthand for most common usage"""
-		return self.calculate_temperature_quadratic(resistance)
+		return self.calculate_temperature_cvd(resistance)
 
 
 	def calculate_temperature_linear(self, resistance):
 
 		# Linear approximation:
-		T_C_linear = ((resistance / self.R_0dC) - 1) / self.a
+		T_C_linear = ((resistance * self._inv_R_0dC) - 1) * self._inv_a
 		return T_C_linear
 
 	def calculate_temperature_quadratic(self, resistance):
@@ -151,12 +236,28 @@ class PT_RTD:
 		# Quadratic approximation (unfortunately the constants do not follow convention):
 		# R_RTD / R_0dC = 1 + aT + bt^2
 		# T = (-a +- sqrt(a^2-4b(1-R_RTD/R_0dC))) / 2b
-		T_C_quadratic = ( -self.a + sqrt((self.a**2)-4*self.b*(1-(resistance/self.R_0dC))) )/(2*self.b)
+		T_C_quadratic = ( -self.a + sqrt(self._a_squared - self._4b*(1-(resistance*self._inv_R_0dC))) ) * self._inv_2b
 		return T_C_quadratic
 
-#	def calculate_temperature_quartic(self, resistance):
-		# Full Callendar-Van Dussen, improves on quad below 0dC.
-		# tbd
+	def calculate_temperature_cvd(self, resistance):
+
+		# Full Callendar-Van Dussen. At and above 0dC (c_pos = 0) it is the quadratic, exactly; below 0dC, where the
+		# quadratic ignores c_neg, it is interpolated from a table shared by every RTD with the same constants
+		# (see linearise.RTDTable).
+		if resistance >= self.R_0dC and not self.c_pos:
+			return self.calculate_temperature_quadratic(resistance)
+		return self.table()(resistance)
+
+	def temperatures(self, resistances):
+
+		# Full Callendar-Van Dussen for a batch of resistances in one interpolation (NaN for any out of range).
+		return self.table().temperatures(resistances)
+
+	def table(self):
+		if self._table is None:
+			from linearise import rtd_table
+			self._table = rtd_table(self.R_0dC, self.a, self.b, self.c_neg)
+		return self._table
 
 
 # test
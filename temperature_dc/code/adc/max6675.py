@@ -1,59 +1,127 @@
-import RPi.GPIO as GPIO
+import abc
+import threading
 import time
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-
-# set pin number for communicate with MAX6675
-def set_pin (CS, SCK, SO, UNIT):
-    global sck
-    sck= SCK
-    global so
-    so = SO
-    global unit
-    unit = UNIT
-    
-    GPIO.setup(CS, GPIO.OUT, initial = GPIO.HIGH)
-    GPIO.setup(SCK, GPIO.OUT, initial = GPIO.LOW)
-    GPIO.setup(SO, GPIO.IN)
-
-def read_temp(cs_no):
-    
-    GPIO.output(cs_no, GPIO.LOW)
-    time.sleep(0.002)
-    GPIO.output(cs_no, GPIO.HIGH)
-    time.sleep(0.22)
-
-    GPIO.output(cs_no, GPIO.LOW)
-    GPIO.output(sck, GPIO.HIGH)
-    time.sleep(0.001)
-    GPIO.output(sck, GPIO.LOW)
-    Value = 0
-    for i in range(11, -1, -1):
-        GPIO.output(sck, GPIO.HIGH)
-        Value = Value + (GPIO.input(so) * (2 ** i))
-        GPIO.output(sck, GPIO.LOW)
-
-    GPIO.output(sck, GPIO.HIGH)
-    error_tc = GPIO.input(so)
-    GPIO.output(sck, GPIO.LOW)
-
-    for i in range(2):
-        GPIO.output(sck, GPIO.HIGH)
-        time.sleep(0.001)
-        GPIO.output(sck, GPIO.LOW)
-
-    GPIO.output(cs_no, GPIO.HIGH)
-
-    if unit == 0:
-        temp = Value
-    if unit == 1:
-        temp = Value * 0.25
-    if unit == 2:
-        temp = Value * 0.25 * 9.0 / 5.0 + 32.0
-
-    if error_tc != 0:
-        return -cs_no
-    else:
-        return temp
-
-GPIO.cleanup()
\ No newline at end of file
+
+# The MAX6675 starts a conversion when CS goes high and needs up to 0.22 s to finish. Pulling CS low before then
+# aborts it and returns the previous result, so each chip is only read once its conversion is done. Reads in between
+# return the last value without touching the bus.
+CONVERSION_TIME = 0.22
+
+UNIT_RAW = 0
+UNIT_CELSIUS = 1
+UNIT_FAHRENHEIT = 2
+
+
+class ThermocoupleOpen(ValueError):
+    pass
+
+
+def decode(word, unit=UNIT_CELSIUS):
+    # D15 dummy, D14-D3 temperature in 0.25 C steps, D2 set when the thermocouple input is open
+    if word & 0x4:
+        raise ThermocoupleOpen('MAX6675 thermocouple input open')
+    value = (word >> 3) & 0xFFF
+    if unit == UNIT_RAW:
+        return value
+    if unit == UNIT_CELSIUS:
+        return value * 0.25
+    if unit == UNIT_FAHRENHEIT:
+        return value * 0.25 * 9.0 / 5.0 + 32.0
+    raise Exception(f'MAX6675 unit {unit} not recognised')
+
+
+class Bank(abc.ABC):
+    # Chips sharing one transport. When any chip's conversion is due, every due chip is read in the same sweep, so
+    # n thermocouples cost one pass per conversion period rather than n sleeps.
+    def __init__(self, conversion_time=CONVERSION_TIME):
+        self.conversion_time = conversion_time
+        self.chips = {}  # cs -> [conversion started, last word]
+        self.lock = threading.Lock()
+
+    def add(self, cs):
+        with self.lock:
+            if cs not in self.chips:
+                self.chips[cs] = [None, None]
+
+    def read(self, cs):
+        with self.lock:
+            now = time.monotonic()
+            started = self.chips[cs][0]
+            if started is None or now - started >= self.conversion_time:
+                for chip_cs, state in self.chips.items():
+                    if state[0] is None or now - state[0] >= self.conversion_time:
+                        state[1] = self.transfer(chip_cs)
+                        state[0] = time.monotonic()  # CS back high, next conversion running
+            return self.chips[cs][1]
+
+    @abc.abstractmethod
+    def transfer(self, cs):
+        """clock one 16 bit word out of the chip on cs"""
+
+
+class BitBangBank(Bank):
+    # Chips with their own CS pin on a shared clock/data pair, clocked out through RPi.GPIO without any delays
+    # (the MAX6675 clocks at up to 4.3 MHz, much faster than Python can toggle a pin)
+    banks = {}
+
+    @classmethod
+    def get(cls, sck, so):
+        if (sck, so) not in cls.banks:
+            cls.banks[(sck, so)] = cls(sck, so)
+        return cls.banks[(sck, so)]
+
+    def __init__(self, sck, so):
+        super().__init__()
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        self.sck = sck
+        self.so = so
+        GPIO.setup(sck, GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(so, GPIO.IN)
+
+    def add(self, cs):
+        self.GPIO.setup(cs, self.GPIO.OUT, initial=self.GPIO.HIGH)
+        super().add(cs)
+
+    def transfer(self, cs):
+        GPIO = self.GPIO
+        sck, so = self.sck, self.so
+        output, read = GPIO.output, GPIO.input
+        word = 0
+        output(cs, GPIO.LOW)
+        for _ in range(16):
+            output(sck, GPIO.HIGH)
+            word = (word << 1) | read(so)
+            output(sck, GPIO.LOW)
+        output(cs, GPIO.HIGH)
+        return word
+
+
+class SpiBank(Bank):
+    # A chip on a hardware SPI chip select (spidev), one 2 byte transfer per read
+    banks = {}
+
+    @classmethod
+    def get(cls, bus, device, speed):
+        if (bus, device) not in cls.banks:
+            cls.banks[(bus, device)] = cls(bus, device, speed)
+        return cls.banks[(bus, device)]
+
+    def __init__(self, bus, device, speed):
+        super().__init__()
+        import spidev
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = speed
+        self.spi.mode = 0
+
+    def transfer(self, cs):
+        high, low = self.spi.readbytes(2)
+        return (high << 8) | low
+
+
+def cleanup():
+    import RPi.GPIO as GPIO
+    GPIO.cleanup()
@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Batch reads and conversions for Sequent Microsystems' stackable RTD cards, on top of the register map and smbus
+# module of their vendored driver (SequentMicrosystemsRTDHAT, left as published).
+
+import struct
+
+try:
+    import numpy
+except ImportError:  # batches are converted one reading at a time
+    numpy = None
+
+
+def poly5(res):
+    """
+    5th order polynomial fit of Temperature (C) as a function of RTD resistance, with the coefficients of
+    SequentMicrosystemsRTDHAT.get_poly5. Works on a single resistance or, element-wise, on a numpy array of them.
+    """
+    c5 = -2.10678E-11
+    c4 = 2.27311E-08
+    c3 = -8.20888E-06
+    c2 = 2.38589E-03
+    c1 = 2.24745E+00
+    c0 = -2.42522E+02
+
+    return ((((res * c5 + c4) * res + c3) * res + c2) * res + c1) * res + c0
+
+
+def poly5_all(resistances):
+    """poly5 over a list of resistances, vectorised with numpy when it is installed"""
+    if numpy is None:
+        return [poly5(res) for res in resistances]
+    return poly5(numpy.asarray(resistances, dtype=float)).tolist()
+
+
+class RTDCards:
+    """
+    Reads stacked RTD cards over one I2C bus handle that stays open. All 8 channels of a card are read in a single
+    32 byte block transaction, so scanning n cards costs n transactions rather than an open/read/close per channel.
+    """
+
+    CHANNELS = 8
+
+    def __init__(self, bus=1):
+        import adc.SequentMicrosystemsRTDHAT as RTDHAT
+        self.address = RTDHAT.DEVICE_ADDRESS
+        self.register = RTDHAT.RTD_RESISTANCE_ADD
+        self.bus = RTDHAT.smbus.SMBus(bus)
+
+    def read_resistances(self, stack):
+        """resistances of channels 1-8 of the card at this stack level"""
+        if stack < 0 or stack > 7:
+            raise ValueError('Invalid stack level')
+        try:
+            buff = self.bus.read_i2c_block_data(self.address + stack, self.register, 4 * self.CHANNELS)
+        except Exception as e:
+            raise ValueError('Fail to communicate with the RTD card with message: \"' + str(e) + '\"')
+        return list(struct.unpack(f'{self.CHANNELS}f', bytearray(buff)))
+
+    def scan(self, stacks, convert=poly5_all):
+        """{stack: [temperature of channels 1-8]} for each card"""
+        return self.convert({stack: self.read_resistances(stack) for stack in stacks}, convert)
+
+    def convert(self, resistances, convert=poly5_all):
+        """{stack: [resistance]} to {stack: [temperature]}, the whole scan converted in one call of convert"""
+        flat = convert([res for stack in resistances for res in resistances[stack]])
+        return {stack: flat[i * self.CHANNELS:(i + 1) * self.CHANNELS] for i, stack in enumerate(resistances)}
+
+    def close(self):
+        self.bus.close()
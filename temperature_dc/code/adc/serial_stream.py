@@ -0,0 +1,135 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import collections
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger("main.measure.serial_stream")
+
+
+class SerialStream:
+    """
+    Keeps a serial port open and parses the line delimited JSON it streams (e.g. {"T": 21.5, "T2": 22.0}) on a
+    background thread into a ring buffer of (monotonic time, fields). One stream per port, shared by every channel
+    that reads a field from it: each gets it with get and gives it back with release, and the last to release it
+    closes the port.
+    """
+    streams = {}
+
+    @classmethod
+    def get(cls, port, baudrate, size):
+        if port not in cls.streams:
+            cls.streams[port] = cls(port, baudrate, size)
+        stream = cls.streams[port]
+        stream.users += 1
+        return stream
+
+    def __init__(self, port, baudrate, size=64, retry_delay=1):
+        self.port = port
+        self.baudrate = baudrate
+        self.retry_delay = retry_delay
+        self.lines = collections.deque(maxlen=size)
+        self.lock = threading.Lock()  # the reader thread appends while channels read
+        self.bad_lines = 0
+        self.users = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"serial-{port}", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        import serial
+        while self.running:
+            try:
+                with serial.Serial(port=self.port, baudrate=self.baudrate, timeout=1) as ser:
+                    logger.info("Reading serial stream on %s", self.port)
+                    self.read_lines(ser)
+            except serial.SerialException as e:
+                logger.error("Serial port %s failed: %s, retrying in %ss", self.port, e, self.retry_delay)
+                time.sleep(self.retry_delay)
+            except Exception as e:
+                # anything else would end the thread and leave the channels reading its last line until max_age
+                logger.error("Serial stream on %s stopped by %r, restarting in %ss", self.port, e, self.retry_delay)
+                time.sleep(self.retry_delay)
+
+    def read_lines(self, ser):
+        partial = b""
+        while self.running:
+            chunk = ser.read(ser.in_waiting or 1)
+            if not chunk:
+                continue
+            *lines, partial = (partial + chunk).split(b"\n")
+            for line in lines:
+                self.parse(line)
+
+    def parse(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            fields = json.loads(line)
+            if not isinstance(fields, dict):
+                raise ValueError("not a JSON object")
+        except ValueError:
+            self.bad_lines += 1
+            logger.debug("Skipped malformed line from %s: %r", self.port, line)
+            return
+        with self.lock:
+            self.lines.append((time.monotonic(), fields))
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.lines)
+
+    def latest(self, field, max_age=None):
+        """newest value of field, ValueError if there is none (or it is older than max_age seconds)"""
+        for received, fields in reversed(self.snapshot()):
+            if field in fields:
+                if max_age is not None and time.monotonic() - received > max_age:
+                    raise ValueError(f"Last {field} from {self.port} is {time.monotonic() - received:.1f}s old")
+                return fields[field]
+        raise ValueError(f"No {field} received from {self.port} yet")
+
+    def window(self, field, n):
+        """up to n most recent values of field, oldest first"""
+        values = [fields[field] for _, fields in reversed(self.snapshot()) if field in fields][:n]
+        values.reverse()
+        return values
+
+    def release(self):
+        self.users -= 1
+        if self.users <= 0:
+            if self.streams.get(self.port) is self:
+                del self.streams[self.port]
+            self.close()
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=2)
@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import bisect
+import math
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile using the P-squared algorithm (Jain & Chlamtac, 1985): five markers whose
+    heights are adjusted with piecewise-parabolic interpolation, so memory and time per sample are constant.
+    The first exact_size samples are kept and give an exact answer, then seed the markers, which keeps small windows
+    accurate (plain P-squared only settles after a few dozen samples).
+    """
+
+    def __init__(self, p, exact_size=32):
+        self.p = p
+        self.exact_size = max(exact_size, 5)
+        self.reset()
+
+    def reset(self):
+        self.samples = []  # sorted, until exact_size is exceeded
+        self.heights = None
+        self.positions = None
+        self.desired = None
+        p = self.p
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def seed(self):
+        samples = self.samples
+        n = len(samples)
+        self.desired = [1 + (n - 1) * q for q in self.increments]
+        self.positions = [int(round(position)) for position in self.desired]
+        # markers must sit on distinct samples
+        for i in (1, 2, 3):
+            self.positions[i] = min(max(self.positions[i], self.positions[i - 1] + 1), n - (4 - i))
+        self.heights = [samples[position - 1] for position in self.positions]
+        self.samples = None
+
+    def add(self, x):
+        if self.heights is None:
+            bisect.insort(self.samples, x)
+            if len(self.samples) > self.exact_size:
+                self.seed()
+            return
+
+        h = self.heights
+        n = self.positions
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = min(bisect.bisect_right(h, x) - 1, 3)
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < candidate < h[i + 1]:
+                    candidate = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = candidate
+                n[i] += d
+
+    def value(self):
+        if self.heights is not None:
+            return self.heights[2]
+        samples = self.samples
+        if not samples:
+            return None
+        # exact - interpolate between the sorted samples
+        rank = self.p * (len(samples) - 1)
+        lower = int(rank)
+        upper = min(lower + 1, len(samples) - 1)
+        return samples[lower] + (samples[upper] - samples[lower]) * (rank - lower)
+
+
+class WindowStats:
+    """Running count, mean, variance (Welford), min, max and approximate percentiles over one window"""
+
+    def __init__(self, percentiles=()):
+        self.quantiles = [(percentile, P2Quantile(percentile / 100)) for percentile in percentiles]
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        for _, quantile in self.quantiles:
+            quantile.reset()
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        for _, quantile in self.quantiles:
+            quantile.add(x)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def summary(self, prefix):
+        """the window's statistics as payload fields, e.g. temp_min, temp_p95"""
+        fields = {f"{prefix}_min": self.min, f"{prefix}_max": self.max,
+                  f"{prefix}_stddev": math.sqrt(self.variance), "count": self.count}
+        for percentile, quantile in self.quantiles:
+            fields[f"{prefix}_p{percentile:g}"] = quantile.value()
+        return fields
+
+
+class QuantityAggregator:
+    """
+    Combines the extra quantities a driver returns alongside temperature (see the notes in drivers) over one
+    window, each with its own rule: mean, min, max, last, or "or" for bit flags such as fault status.
+    """
+    RULES = ("mean", "min", "max", "last", "or")
+
+    def __init__(self, rules):
+        for name, rule in rules.items():
+            if rule not in self.RULES:
+                raise Exception(f'Aggregation rule "{rule}" for {name} not recognised')
+        self.rules = rules
+        self.reset()
+
+    def reset(self):
+        self.values = {}
+        self.counts = {}
+
+    def add(self, reading):
+        for name, rule in self.rules.items():
+            value = reading.get(name)
+            if value is None:
+                continue
+            count = self.counts.get(name, 0) + 1
+            self.counts[name] = count
+            if count == 1 or rule == "last":
+                self.values[name] = value
+            elif rule == "mean":
+                self.values[name] += (value - self.values[name]) / count
+            elif rule == "min":
+                self.values[name] = min(self.values[name], value)
+            elif rule == "max":
+                self.values[name] = max(self.values[name], value)
+            else:
+                self.values[name] |= value
+
+    def summary(self):
+        return dict(self.values)
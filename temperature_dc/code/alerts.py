@@ -0,0 +1,160 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Alert states for a channel's samples, kept in the measure stage so that only changes are published (as events on
+# <channel path>/alert) rather than a stateless comparison repeated in every reading.
+
+
+class Debounced:
+    """An alert state that only changes once a new state has held for min_dwell seconds"""
+
+    def __init__(self, min_dwell=0.0):
+        self.min_dwell = min_dwell
+        self.state = 0
+        self.pending = None
+        self.pending_since = None
+
+    def update(self, candidate, now):
+        """returns the previous state if the state changed, None otherwise"""
+        if candidate == self.state:
+            self.pending = None
+            return None
+        if candidate != self.pending:
+            self.pending = candidate
+            self.pending_since = now
+        if now - self.pending_since < self.min_dwell:
+            return None
+        previous = self.state
+        self.state = candidate
+        self.pending = None
+        return previous
+
+
+class AlertEngine:
+    """
+    Three alerts per channel, each 1 (high / rising), -1 (low / falling) or 0:
+      level      - the value is above th_high or below th_low, cleared once it is back inside by more than hysteresis
+      rate       - the slope is steeper than rate_limit (degrees per minute), cleared once it is back under
+                   rate_limit - rate_hysteresis
+      predicted  - the value is inside the limits but, extrapolating the slope in a straight line, will cross one
+                   within horizon seconds
+    A state only changes after it has held for min_dwell seconds, so noise around a limit does not make it flap.
+    """
+
+    def __init__(self, th_low, th_high, hysteresis=0.0, min_dwell=0.0, rate_limit=None, rate_hysteresis=0.0,
+                 horizon=None):
+        self.th_low = th_low
+        self.th_high = th_high
+        self.hysteresis = hysteresis
+        self.rate_limit = rate_limit
+        self.rate_hysteresis = rate_hysteresis
+        self.horizon = horizon
+
+        self.level = Debounced(min_dwell)
+        self.rate = Debounced(min_dwell)
+        self.predicted = Debounced(min_dwell)
+        self.time_to_threshold = None
+
+    @classmethod
+    def from_config(cls, conf, th_low, th_high):
+        """AlertEngine for an [alerts] table, or None if it is not enabled"""
+        if not conf.get('enabled', False):
+            return None
+        return cls(th_low, th_high, conf.get('hysteresis', 0.0), conf.get('min_dwell', 0.0), conf.get('rate_limit'),
+                   conf.get('rate_hysteresis', 0.0), conf.get('horizon'))
+
+    @property
+    def needs_slope(self):
+        return self.rate_limit is not None or self.horizon is not None
+
+    def level_candidate(self, value):
+        if value > self.th_high:
+            return 1
+        if value < self.th_low:
+            return -1
+        if self.level.state == 1 and value > self.th_high - self.hysteresis:
+            return 1
+        if self.level.state == -1 and value < self.th_low + self.hysteresis:
+            return -1
+        return 0
+
+    def rate_candidate(self, slope):
+        per_minute = slope * 60
+        if per_minute > self.rate_limit:
+            return 1
+        if per_minute < -self.rate_limit:
+            return -1
+        if self.rate.state == 1 and per_minute > self.rate_limit - self.rate_hysteresis:
+            return 1
+        if self.rate.state == -1 and per_minute < -(self.rate_limit - self.rate_hysteresis):
+            return -1
+        return 0
+
+    def estimate_time_to_threshold(self, value, slope):
+        """seconds until value crosses the limit it is heading towards at slope (per second), None if it is not"""
+        if slope > 0 and value <= self.th_high:
+            return (self.th_high - value) / slope
+        if slope < 0 and value >= self.th_low:
+            return (value - self.th_low) / -slope
+        return None
+
+    def update(self, value, slope, now):
+        """
+        Evaluates a sample, with the current slope in units per second (None if not known yet).
+        Returns (alert, state, previous state) for each alert that changed.
+        """
+        changes = []
+        previous = self.level.update(self.level_candidate(value), now)
+        if previous is not None:
+            changes.append(("level", self.level.state, previous))
+
+        if slope is None:
+            self.time_to_threshold = None
+            return changes
+
+        if self.rate_limit is not None:
+            previous = self.rate.update(self.rate_candidate(slope), now)
+            if previous is not None:
+                changes.append(("rate", self.rate.state, previous))
+
+        if self.horizon is not None:
+            self.time_to_threshold = self.estimate_time_to_threshold(value, slope)
+            candidate = 0
+            if self.level.state == 0 and self.time_to_threshold is not None and \
+                    self.time_to_threshold <= self.horizon:
+                candidate = 1 if slope > 0 else -1
+            previous = self.predicted.update(candidate, now)
+            if previous is not None:
+                changes.append(("predicted", self.predicted.state, previous))
+        return changes
+
+    def threshold(self, alert, state):
+        """the limit an alert state refers to, None for rate alerts and cleared states"""
+        if alert == "rate" or state == 0:
+            return None
+        return self.th_high if state == 1 else self.th_low
@@ -0,0 +1,170 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import logging
+import os
+import struct
+
+logger = logging.getLogger("main.wrapper.buffer")
+
+# record = header (payload length, topic length) + topic + payload
+RECORD_HEADER = struct.Struct(">IH")
+SEGMENT_SUFFIX = ".seg"
+
+
+class DiskBuffer:
+    """
+    Bounded store-and-forward buffer of (topic, payload) records kept in append-only segment files.
+
+    Records are appended to the newest segment and read back from the oldest. A segment is deleted once it has been
+    read and committed, or when the total size goes over max_bytes, in which case the oldest records are dropped
+    first. Segments left by a previous run are picked up on start, so readings survive a restart of the container
+    (a partly replayed segment is replayed again from its start).
+    """
+
+    def __init__(self, directory, max_bytes=50_000_000, segment_bytes=1_000_000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = min(segment_bytes, max_bytes)
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                               if name.endswith(SEGMENT_SUFFIX))
+        self.sizes = {seq: os.path.getsize(self.segment_path(seq)) for seq in self.segments}
+        self.total_bytes = sum(self.sizes.values())
+        self.dropped = 0
+
+        self.writer = None  # file object of the newest segment
+        self.reader = None  # file object of the oldest segment
+        self.read_offset = 0  # position in the oldest segment up to which records have been committed
+        self.pending = []  # (offset after record) of records handed out by read() but not yet committed
+
+        if self.segments:
+            logger.info("found %s bytes of buffered readings in %s segments", self.total_bytes, len(self.segments))
+
+    def segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}{SEGMENT_SUFFIX}")
+
+    @property
+    def pending_bytes(self):
+        """bytes of records held, including any read but not yet committed"""
+        return self.total_bytes
+
+    def is_empty(self):
+        return self.total_bytes == 0
+
+    def append(self, topic, payload):
+        topic = topic.encode("utf8")
+        if isinstance(payload, str):
+            payload = payload.encode("utf8")
+        record = RECORD_HEADER.pack(len(payload), len(topic)) + topic + payload
+
+        if self.writer is None or self.sizes[self.segments[-1]] + len(record) > self.segment_bytes:
+            self.roll()
+        self.writer.write(record)
+        self.writer.flush()
+        self.sizes[self.segments[-1]] += len(record)
+        self.total_bytes += len(record)
+
+        while self.total_bytes > self.max_bytes and len(self.segments) > 1:
+            self.evict_oldest()
+
+    def roll(self):
+        if self.writer is not None:
+            self.writer.close()
+        seq = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+        self.writer = open(self.segment_path(seq), "ab")
+
+    def evict_oldest(self):
+        seq = self.segments.pop(0)
+        logger.warning("buffer full (%s > %s bytes), dropping oldest segment %s", self.total_bytes, self.max_bytes, seq)
+        self.dropped += 1
+        self.remove_segment(seq)
+
+    def remove_segment(self, seq):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.read_offset = 0
+        self.pending = []
+        self.total_bytes -= self.sizes.pop(seq)
+        os.remove(self.segment_path(seq))
+
+    def read(self, max_records):
+        """returns up to max_records of the oldest (topic, payload) records, to be passed to commit() once sent"""
+        records = []
+        while not records and self.segments:
+            seq = self.segments[0]
+            if self.writer is not None and seq == self.segments[-1]:
+                self.writer.flush()
+            if self.reader is None:
+                self.reader = open(self.segment_path(seq), "rb")
+                self.reader.seek(self.read_offset)
+
+            while len(records) < max_records:
+                header = self.reader.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                payload_length, topic_length = RECORD_HEADER.unpack(header)
+                body = self.reader.read(topic_length + payload_length)
+                if len(body) < topic_length + payload_length:
+                    break  # truncated by a crash mid-write
+                records.append((body[:topic_length].decode("utf8"), body[topic_length:]))
+                self.pending.append(self.reader.tell())
+
+            if not records:
+                if seq == self.segments[-1]:
+                    # nothing more has been written yet - drop the fully read active segment so appends start afresh
+                    if self.read_offset == self.sizes[seq] or self.writer is None:
+                        if self.writer is not None:
+                            self.writer.close()
+                            self.writer = None
+                        self.segments.pop(0)
+                        self.remove_segment(seq)
+                    else:
+                        self.reader.seek(self.read_offset)
+                    break
+                # end of an older segment (possibly with a truncated last record)
+                self.segments.pop(0)
+                self.remove_segment(seq)
+        return records
+
+    def commit(self, count):
+        """mark the first count records returned by the last read() as sent, the rest will be read again"""
+        if count > 0 and self.pending:
+            self.read_offset = self.pending[count - 1]
+        self.pending = []
+        if self.reader is not None:
+            self.reader.seek(self.read_offset)
+
+    def close(self):
+        for f in (self.reader, self.writer):
+            if f is not None:
+                f.close()
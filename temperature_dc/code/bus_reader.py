@@ -0,0 +1,149 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import logging
+import math
+import time
+import concurrent.futures
+
+logger = logging.getLogger("main.measure.bus_reader")
+
+
+class MissedSample(Exception):
+    pass
+
+
+class BusReader:
+    """
+    Reads channels on a pool of worker threads. Channels are grouped by the bus their sensor uses: each group is read
+    in order on one worker thread, so transactions on a shared I2C/SPI bus never overlap, while different buses are
+    read at the same time. Reads that have not finished by their deadline are reported as MissedSample and the bus
+    is skipped until its stuck read returns.
+
+    read() reads every channel and waits for them. The measure loop instead submits the channels that are due,
+    waits for results or its next deadline, and collects whatever has finished, so a slow sensor never holds up a
+    fast one on another bus.
+    """
+
+    def __init__(self, channels, timeout, max_workers=8):
+        self.timeout = timeout
+
+        self.groups = {}
+        for channel in channels:
+            self.groups.setdefault(self.bus_of(channel), []).append(channel)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(self.groups))),
+                                                              thread_name_prefix="bus_reader")
+        self.in_flight = {}  # bus_id -> future of a read that overran a previous deadline
+        self.pending = {}  # future -> (bus_id, channels, results, deadline)
+        self.finished = {}  # channel name -> sample or Exception, waiting to be collected
+        self.interrupted = concurrent.futures.Future()  # completed by interrupt() to end a wait early
+
+    @staticmethod
+    def bus_of(channel):
+        return getattr(channel.sensor, "bus_id", channel.name)
+
+    @staticmethod
+    def read_group(channels, results):
+        for channel in channels:
+            start = time.perf_counter()
+            try:
+                results[channel.name] = channel.read()
+            except Exception as e:
+                results[channel.name] = e
+            channel.read_latency.observe(time.perf_counter() - start)
+
+    def submit(self, channels, now):
+        """start reading these channels, each bus to be collected by now + the shortest read_timeout of its channels"""
+        groups = {}
+        for channel in channels:
+            groups.setdefault(self.bus_of(channel), []).append(channel)
+
+        for bus_id, group in groups.items():
+            previous = self.in_flight.get(bus_id)
+            if previous is not None:
+                if not previous.done():
+                    for channel in group:
+                        self.finished[channel.name] = MissedSample(f"bus {bus_id} still busy with an earlier read")
+                    continue
+                del self.in_flight[bus_id]
+            # each group gets its own dict so a read that completes after the deadline can't leak into a later one
+            results = {}
+            future = self.executor.submit(self.read_group, group, results)
+            self.in_flight[bus_id] = future
+            timeout = min(getattr(channel, "read_timeout", None) or self.timeout for channel in group)
+            self.pending[future] = (bus_id, group, results, now + timeout)
+
+    def next_deadline(self):
+        return min((deadline for _, _, _, deadline in self.pending.values()), default=math.inf)
+
+    def wait(self, timeout):
+        """block until a submitted read finishes or timeout passes, True if anything can be collected"""
+        if self.finished:
+            return True
+        if not self.pending:
+            return False
+        done, _ = concurrent.futures.wait(list(self.pending) + [self.interrupted], timeout=max(0.0, timeout),
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        return any(future is not self.interrupted for future in done)
+
+    def interrupt(self):
+        """wake a wait() in progress, and make later ones return at once (from another thread, e.g. to stop)"""
+        if not self.interrupted.done():
+            self.interrupted.set_result(None)
+
+    def collect(self, now):
+        """{channel name: sample or Exception} for reads that finished or passed their deadline"""
+        for future, (bus_id, group, results, deadline) in list(self.pending.items()):
+            done = future.done()
+            if not done and now < deadline:
+                continue
+            del self.pending[future]
+            if done and self.in_flight.get(bus_id) is future:
+                del self.in_flight[bus_id]
+            for channel in group:
+                # read dict once - on a late bus the worker may still be adding to it
+                sample = results.get(channel.name)
+                if sample is None:
+                    sample = MissedSample("read did not complete within its deadline")
+                self.finished[channel.name] = sample
+        finished, self.finished = self.finished, {}
+        return finished
+
+    def read(self):
+        """returns {channel name: sample (a temperature, or a dict from get_reading) or Exception}"""
+        now = time.monotonic()
+        self.submit([channel for channels in self.groups.values() for channel in channels], now)
+        results = {}
+        while self.pending or self.finished:
+            self.wait(self.next_deadline() - time.monotonic())
+            results.update(self.collect(time.monotonic()))
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,69 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Encodings for the measure -> wrapper hop. Messages are {"path": str, "payload": dict, "sent": float};
+# the payload is only turned into JSON once, by the wrapper, when it is published over MQTT.
+
+import json
+
+
+class JSONCodec:
+    name = "json"
+
+    @staticmethod
+    def encode(msg):
+        return json.dumps(msg).encode("utf8")
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+        self.packer = msgpack.Packer(use_bin_type=True)
+        self.unpackb = msgpack.unpackb
+
+    def encode(self, msg):
+        return self.packer.pack(msg)
+
+    def decode(self, data):
+        return self.unpackb(data, raw=False)
+
+
+CODECS = {"json": JSONCodec, "msgpack": MsgpackCodec}
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise Exception(f'IPC codec "{name}" not recognised/supported')
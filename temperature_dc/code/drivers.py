@@ -0,0 +1,111 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Registry of sensor drivers, looked up by the adc name used in config.toml.
+#
+# Built-in drivers in sensor_select register themselves with the @register decorator. Other drivers can do the same
+# from a module listed in [sensing] driver_modules, or be published by an installed package under the
+# "temperature_dc.drivers" entry point group (name = adc name, value = "module:Class").
+# A driver's dependencies are only imported when a channel using it is created, so startup only loads the
+# libraries that are actually needed.
+#
+# A driver instance provides get_temperature(), and a bus_id naming the bus it shares with other sensors. A driver
+# that measures more than temperature can provide get_reading() instead, returning {"temp": ..., <name>: ...}
+# (temp None for an invalid reading), with a QUANTITIES class attribute giving each extra name's aggregation rule
+# over a window (see aggregate.QuantityAggregator). The extra quantities are published alongside temp.
+
+import importlib
+import logging
+import time
+import metrics
+
+logger = logging.getLogger("main.measure.drivers")
+
+ENTRY_POINT_GROUP = "temperature_dc.drivers"
+
+
+class Driver:
+    def __init__(self, name, factory=None, requires=(), entry_point=None):
+        self.name = name
+        self.factory = factory
+        self.requires = tuple(requires)
+        self.entry_point = entry_point
+
+    def load(self):
+        if self.factory is None:
+            self.factory = self.entry_point.load()
+            self.requires = tuple(getattr(self.factory, "requires", ()))
+        for module in self.requires:
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                raise Exception(f'ADC "{self.name}" needs the {module} package, which could not be imported ({e})')
+        return self.factory
+
+
+REGISTRY = {}
+
+
+def register(name, requires=()):
+    """class decorator adding a driver under the adc name, with the modules it needs"""
+    def decorator(cls):
+        if name in REGISTRY:
+            logger.warning('driver "%s" registered more than once, using %s.%s', name, cls.__module__, cls.__name__)
+        REGISTRY[name] = Driver(name, cls, requires)
+        return cls
+    return decorator
+
+
+def load_plugins(modules=()):
+    for module in modules:
+        importlib.import_module(module)
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    try:
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # python < 3.10
+        found = entry_points().get(ENTRY_POINT_GROUP, [])
+    for entry_point in found:
+        if entry_point.name not in REGISTRY:
+            REGISTRY[entry_point.name] = Driver(entry_point.name, entry_point=entry_point)
+
+
+def create(name, params):
+    driver = REGISTRY.get(name)
+    if driver is None:
+        raise Exception(f'ADC "{name}" not recognised/supported (available: {", ".join(sorted(REGISTRY))})')
+    start = time.monotonic()
+    sensor = driver.load()(**params)
+    load_time = time.monotonic() - start
+    metrics.REGISTRY.gauge("temperature_dc_driver_load_seconds", "Time to import and construct a driver",
+                           driver=name).set(load_time)
+    logger.info('loaded %s driver in %.3fs', name, load_time)
+    return sensor
@@ -0,0 +1,149 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import array
+import bisect
+
+try:
+    import numpy
+except ImportError:  # statistics in plain python
+    numpy = None
+
+
+class History:
+    """
+    The last capacity samples of one channel as (monotonic time, value), in two fixed array('d') rings, so memory
+    does not grow with uptime. A trailing period is at most two contiguous slices of the rings (before and after the
+    wrap point), and statistics are sums over those slices: numpy over zero-copy views when it is installed, plain
+    python otherwise. Nothing is reordered or copied into chronological order.
+    """
+
+    def __init__(self, capacity=600):
+        if capacity < 2:
+            raise Exception(f'history capacity must be at least 2, not {capacity}')
+        self.capacity = capacity
+        self.times = array.array('d', bytes(8 * capacity))
+        self.values = array.array('d', bytes(8 * capacity))
+        self.head = 0  # next slot to write
+        self.count = 0
+        if numpy is not None:
+            # zero-copy views of the rings
+            self.times_view = numpy.frombuffer(self.times, dtype=numpy.float64)
+            self.values_view = numpy.frombuffer(self.values, dtype=numpy.float64)
+        else:
+            self.times_view, self.values_view = self.times, self.values
+
+    def __len__(self):
+        return self.count
+
+    def add(self, t, value):
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def latest(self):
+        """(time, value) of the newest sample, or None"""
+        if not self.count:
+            return None
+        index = self.head - 1
+        return self.times[index], self.values[index]
+
+    def spans(self, seconds=None, now=None):
+        """[(start, stop)] index ranges of the rings holding the period, oldest first (at most two)"""
+        if not self.count:
+            return []
+        if self.count == self.capacity and self.head:
+            spans = [(self.head, self.capacity), (0, self.head)]
+        else:
+            spans = [(0, self.count)]
+        if seconds is None:
+            return spans
+        start_time = (self.times[self.head - 1] if now is None else now) - seconds
+        search = numpy.searchsorted if numpy is not None else None
+        for i, (start, stop) in enumerate(spans):
+            # each span is in time order, so the first one whose last sample is recent enough holds the start
+            if self.times[stop - 1] >= start_time:
+                if search is not None:
+                    first = start + int(search(self.times_view[start:stop], start_time))
+                else:
+                    first = bisect.bisect_left(self.times, start_time, start, stop)
+                return [(first, stop)] + spans[i + 1:]
+        return []
+
+    def window(self, seconds=None, now=None):
+        """(times, values) oldest first, limited to the last seconds before now (the newest sample by default)"""
+        spans = self.spans(seconds, now)
+        times = [self.times_view[start:stop] for start, stop in spans]
+        values = [self.values_view[start:stop] for start, stop in spans]
+        if not spans:
+            return self.times_view[:0], self.values_view[:0]
+        if len(spans) == 1:
+            return times[0], values[0]
+        if numpy is not None:
+            return numpy.concatenate(times), numpy.concatenate(values)
+        return times[0] + times[1], values[0] + values[1]
+
+    def mean(self, seconds=None, now=None):
+        spans = self.spans(seconds, now)
+        n = sum(stop - start for start, stop in spans)
+        if not n:
+            return None
+        if numpy is not None:
+            return sum(float(self.values_view[start:stop].sum()) for start, stop in spans) / n
+        return sum(sum(self.values[start:stop]) for start, stop in spans) / n
+
+    def slope(self, seconds=None, now=None):
+        """least squares rate of change in units per second, None with fewer than 2 samples over a nonzero span"""
+        spans = self.spans(seconds, now)
+        n = sum(stop - start for start, stop in spans)
+        if n < 2:
+            return None
+        # sums of t, v, t*t and t*v with times taken from the oldest sample, to keep the squares small
+        t_0 = self.times[spans[0][0]]
+        sum_t = sum_v = sum_tt = sum_tv = 0.0
+        for start, stop in spans:
+            if numpy is not None:
+                t = self.times_view[start:stop] - t_0
+                v = self.values_view[start:stop]
+                sum_t += float(t.sum())
+                sum_v += float(v.sum())
+                sum_tt += float(t.dot(t))
+                sum_tv += float(t.dot(v))
+            else:
+                for t, v in zip(self.times[start:stop], self.values[start:stop]):
+                    t -= t_0
+                    sum_t += t
+                    sum_v += v
+                    sum_tt += t * t
+                    sum_tv += t * v
+        denominator = n * sum_tt - sum_t * sum_t
+        if denominator <= 0:
+            return None
+        return (n * sum_tv - sum_t * sum_v) / denominator
@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Platinum RTD resistance -> temperature.
+#
+# The Callendar-Van Dusen (CVD) equation gives resistance from temperature:
+#   R(T) = R0 * (1 + a*T + b*T^2)                      T >= 0 C
+#   R(T) = R0 * (1 + a*T + b*T^2 + c*(T - 100)*T^3)    T <  0 C
+# Above 0 C it inverts exactly as a quadratic, below 0 C it has no closed form. RTDTable solves it once, at evenly
+# spaced resistances over the sensor's range, so each conversion is an index and a linear interpolation, and a batch
+# of readings is a single numpy.interp call when numpy is installed.
+
+import functools
+import math
+
+try:
+    import numpy
+except ImportError:  # batches are converted one reading at a time
+    numpy = None
+
+# IEC 60751 constants
+A = 3.9083e-3
+B = -5.775e-7
+C = -4.183e-12
+
+
+def cvd_resistance(t, r_0=100, a=A, b=B, c=C):
+    r = 1 + a * t + b * t * t
+    if t < 0:
+        r += c * (t - 100) * t ** 3
+    return r_0 * r
+
+
+def cvd_temperature(r, r_0=100, a=A, b=B, c=C):
+    """exact inverse of the CVD equation: quadratic above 0 C, refined by Newton's method below"""
+    t = (-a + math.sqrt(a * a - 4 * b * (1 - r / r_0))) / (2 * b)
+    if r >= r_0:
+        return t
+    for _ in range(10):
+        error = cvd_resistance(t, r_0, a, b, c) - r
+        slope = r_0 * (a + 2 * b * t + c * (4 * t ** 3 - 300 * t * t))
+        step = error / slope
+        t -= step
+        if abs(step) < 1e-9:
+            break
+    return t
+
+
+class RTDTable:
+    """
+    Temperatures solved at resistances r_min, r_min + step, ... covering t_min to t_max, with linear interpolation
+    between them. With the default step (R0 / 1000, 0.1 ohm on a PT100) the interpolation error is under 0.0001 C.
+    Resistances outside the table raise ValueError, or give NaN in a batch.
+    """
+
+    def __init__(self, r_0=100, a=A, b=B, c=C, t_min=-200, t_max=850, step=None):
+        self.r_0 = r_0
+        self.step = r_0 / 1000 if step is None else step
+        self.r_min = cvd_resistance(t_min, r_0, a, b, c)
+        r_max = cvd_resistance(t_max, r_0, a, b, c)
+        self.size = int(math.ceil((r_max - self.r_min) / self.step)) + 1
+        self.r_max = self.r_min + (self.size - 1) * self.step
+        self.inv_step = 1 / self.step
+        self.resistances = [self.r_min + i * self.step for i in range(self.size)]
+        self.temperatures_ = [cvd_temperature(r, r_0, a, b, c) for r in self.resistances]
+        self.slopes = [t1 - t0 for t0, t1 in zip(self.temperatures_, self.temperatures_[1:])]
+        self.arrays = None
+
+    def temperature(self, r):
+        x = (r - self.r_min) * self.inv_step
+        i = int(x)
+        if x < 0 or i >= self.size - 1:
+            if r == self.r_max:
+                return self.temperatures_[-1]
+            raise ValueError(f"RTD resistance {r} ohm outside {self.r_min:.2f}-{self.r_max:.2f} ohm")
+        return self.temperatures_[i] + (x - i) * self.slopes[i]
+
+    def temperatures(self, resistances):
+        """list of temperatures for a batch of resistances, NaN where out of range"""
+        if numpy is None:
+            return [self.temperature_or_nan(r) for r in resistances]
+        if self.arrays is None:
+            self.arrays = (numpy.array(self.resistances), numpy.array(self.temperatures_))
+        return numpy.interp(resistances, *self.arrays, left=math.nan, right=math.nan).tolist()
+
+    def temperature_or_nan(self, r):
+        try:
+            return self.temperature(r)
+        except ValueError:
+            return math.nan
+
+    def __call__(self, r):
+        return self.temperature(r)
+
+
+@functools.lru_cache(maxsize=None)
+def rtd_table(r_0=100, a=A, b=B, c=C):
+    """shared table for these constants, e.g. rtd_table(100) for PT100 or rtd_table(1000) for PT1000"""
+    return RTDTable(r_0, a, b, c)
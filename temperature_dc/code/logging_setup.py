@@ -0,0 +1,109 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Logging for every process in the container, set up once in main (building blocks inherit it when they fork).
+#
+# Log calls use lazy %-style arguments (logger.debug("read %s", value)), so a message below the configured level costs
+# a level check and nothing else. Messages that can repeat at the sample rate (missed samples, read errors) pass
+# through RateLimitFilter, which lets the first one through and then one per interval with a count of those dropped.
+
+import json
+import logging
+import threading
+import time
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes a message (keyed by logger, level, unformatted template and its first argument - the channel or process it
+    is about) at most once per interval. The next one to pass notes how many were suppressed in between. interval 0
+    disables the limit.
+    """
+
+    def __init__(self, interval=60):
+        super().__init__()
+        self.interval = interval
+        self.seen = {}  # key -> [time last passed, suppressed since]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.interval or record.levelno < logging.WARNING:
+            return True
+        args = record.args
+        subject = str(args[0]) if isinstance(args, tuple) and args else None
+        key = (record.name, record.levelno, record.msg, subject)
+        now = time.monotonic()
+        with self.lock:
+            state = self.seen.get(key)
+            if state is not None and now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            suppressed = state[1] if state is not None else 0
+            self.seen[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """one JSON object per line, for log collectors"""
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                 "process": record.processName, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure(config=None):
+    """set up the root handler from [logging] in config.toml"""
+    logging_conf = (config or {}).get('logging', {})
+    level = logging_conf.get('level', 'INFO').upper()
+    if level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+        raise Exception(f'Logging level "{level}" not recognised')
+
+    handler = logging.StreamHandler()
+    log_format = logging_conf.get('format', 'text')
+    if log_format == 'json':
+        handler.setFormatter(JSONFormatter())
+    elif log_format == 'text':
+        handler.setFormatter(logging.Formatter(FORMAT))
+    else:
+        raise Exception(f'Logging format "{log_format}" not recognised')
+    handler.addFilter(RateLimitFilter(logging_conf.get('rate_limit_interval', 60)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, logger_level in logging_conf.get('loggers', {}).items():
+        logging.getLogger(name).setLevel(logger_level.upper())
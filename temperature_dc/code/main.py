@@ -33,22 +33,27 @@
 # monitor tasks
 
 # packages
-import tomli
+import sys
 import time
+STARTED = time.monotonic()  # before the imports below, so the cold start metric includes them
+import tomli
 import logging
+import signal
 import zmq
 # local
+import logging_setup
 import measure
 import wrapper
+from supervisor import Health, Supervisor
 
 logger = logging.getLogger("main")
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')  # move to log config file using python functionality
+logging_setup.configure()  # defaults until the config file is read
 
 
 def get_config():
     with open("./config/config.toml", "rb") as f:
         toml_conf = tomli.load(f)
-    logger.info(f"config:{toml_conf}")
+    logger.info("config:%s", toml_conf)
     return toml_conf
 
 
@@ -56,16 +61,35 @@ def config_valid(config):
     return True
 
 
-def create_building_blocks(config):
-    bbs = {}
+def ipc_confs(config):
+    ipc_conf = config.get('ipc', {})
+    transport = ipc_conf.get('transport', 'tcp')
+    if transport == 'tcp':
+        address = "tcp://127.0.0.1:4000"
+    elif transport == 'ipc':
+        address = f"ipc://{ipc_conf.get('path', '/tmp/temperature_dc.ipc')}"
+    else:
+        raise Exception(f'IPC transport "{transport}" not recognised/supported')
+    ipc_codec = ipc_conf.get('codec', 'json')
+
+    # the wrapper binds, so measure (and the supervisor's health messages) can connect and reconnect across
+    # restarts of either side, with readings held in measure's send queue while the wrapper is down
+    measure_out = {"type": zmq.PUSH, "address": address, "bind": False, "codec": ipc_codec}
+    wrapper_in = {"type": zmq.PULL, "address": address, "bind": True, "codec": ipc_codec}
+    return measure_out, wrapper_in
+
 
-    measure_out = {"type": zmq.PUSH, "address": "tcp://127.0.0.1:4000", "bind": True}
-    wrapper_in = {"type": zmq.PULL, "address": "tcp://127.0.0.1:4000", "bind": False}
+def building_block_factories(config, health=None):
+    measure_out, wrapper_in = ipc_confs(config)
+    # the supervisor passes the restart time to restarted blocks, so their cold start is measured from it
+    return {"measure": lambda started=STARTED: measure.TemperatureMeasureBuildingBlock(config, measure_out, started,
+                                                                                       health),
+            "wrapper": lambda started=STARTED: wrapper.MQTTServiceWrapper(config, wrapper_in, started, health)}
 
-    bbs["measure"] = measure.TemperatureMeasureBuildingBlock(config, measure_out)
-    bbs["wrapper"] = wrapper.MQTTServiceWrapper(config, wrapper_in)
 
-    logger.debug(f"bbs {bbs}")
+def create_building_blocks(config, health=None):
+    bbs = {key: factory() for key, factory in building_block_factories(config, health).items()}
+    logger.debug("bbs %s", bbs)
     return bbs
 
 
@@ -74,21 +98,22 @@ def start_building_blocks(bbs):
         p = bbs[key].start()
 
 
-def monitor_building_blocks(bbs):
-    while True:
-        time.sleep(1)
-        for key in bbs:
-            # logger.debug(f"{bbs[key].exitcode}, {bbs[key].is_alive()}")
-            # todo actually monitor
-            pass
+def monitor_building_blocks(config, health):
+    supervisor = Supervisor(building_block_factories(config, health), health, config, ipc_confs(config)[0])
+    # docker stop sends SIGTERM: stop the building blocks in order rather than leaving them to be killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    supervisor.start()
+    try:
+        supervisor.run()
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # a second SIGTERM should not cut the shutdown short
+        supervisor.stop()
 
 
 if __name__ == "__main__":
     config = get_config()
-    # todo set logging level from config file
+    logging_setup.configure(config)
     if config_valid(config):
-        bbs = create_building_blocks(config)
-        start_building_blocks(bbs)
-        monitor_building_blocks(bbs)
+        monitor_building_blocks(config, Health())
     else:
         raise Exception("bad config")
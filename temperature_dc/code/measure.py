@@ -35,25 +35,77 @@
 import datetime
 import logging
 import multiprocessing
+import signal
+import threading
 import time
-import sensor_select as sen
-import importlib
+import sensor_select  # registers the built-in drivers
+import drivers
+import metrics
+from bus_reader import BusReader, MissedSample
+from scheduler import Scheduler
+from aggregate import WindowStats, QuantityAggregator
+from report import Deadband, SwingingDoor
+from history import History
+from alerts import AlertEngine
+import codec
 import zmq
-import serial
-import json
 
-# logging.basicConfig(filename='/app_temp.log', level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# handlers and level are set up once for the container by logging_setup.configure in main
 logger = logging.getLogger("main.measure")
-logger.setLevel(logging.INFO)
-console_handler = logging.StreamHandler()
-logger.addHandler(console_handler)
 
 context = zmq.Context()
 
- 
+# keys of a [[sensing.channels]] entry that are not passed through to the driver constructor
+CHANNEL_KEYS = ("name", "adc", "topic", "threshold", "tags", "reporting", "sample_interval", "publish_interval",
+                "read_timeout", "history", "alerts")
+
+
+class Channel:
+    def __init__(self, name, adc, sensor, path, th_low, th_high, tags, percentiles=()):
+        self.name = name
+        self.adc = adc
+        self.sensor = sensor
+        self.path = path
+        self.th_low = th_low
+        self.th_high = th_high
+        self.tags = tags
+
+        self.read_latency = metrics.REGISTRY.histogram("temperature_dc_read_seconds", "Time taken by sensor reads",
+                                                       metrics.READ_BUCKETS, driver=adc, channel=name)
+        self.read_errors = metrics.REGISTRY.counter("temperature_dc_read_errors_total",
+                                                    "Sensor reads that raised or returned an invalid reading",
+                                                    driver=adc, channel=name)
+        self.missed_total = metrics.REGISTRY.counter("temperature_dc_missed_samples_total",
+                                                     "Samples not read in time", driver=adc, channel=name)
+        self.readings_total = metrics.REGISTRY.counter("temperature_dc_readings_total", "Readings dispatched",
+                                                       driver=adc, channel=name)
+
+        self.stats = WindowStats(percentiles)
+        # extra quantities (fault flags, humidity, ...) from drivers that provide get_reading
+        self.read = getattr(sensor, "get_reading", None) or sensor.get_temperature
+        self.quantities = QuantityAggregator(getattr(sensor, "QUANTITIES", {}))
+        self.sample_interval = None
+        self.publish_interval = None  # None: publish every sample_count samples
+        self.read_timeout = None
+        self.missed = 0
+        self.deadband = None
+        self.compressor = None
+        self.history = None
+        self.trend_window = None
+        self.alerts = None
+        self.alert_events = None
+        self.last_alert = None
+
+
 class TemperatureMeasureBuildingBlock(multiprocessing.Process):
-    def __init__(self, config, zmq_conf):
+    def __init__(self, config, zmq_conf, started=None, health=None):
         super().__init__()
+        self.health = health  # shared with the supervisor in main
+        self.metrics_conf = config.get('metrics', {})
+
+        # monotonic time the container's main process started, for the cold start metric
+        self.started = time.monotonic() if started is None else started
+        self.cold_start = metrics.Gauge("time to first reading dispatched")
 
         self.config = config
         self.constants = config['constants']
@@ -61,22 +113,98 @@ class TemperatureMeasureBuildingBlock(multiprocessing.Process):
         # declarations
         self.zmq_conf = zmq_conf
         self.zmq_out = None
+        self.codec = None
 
         self.collection_interval = config['sampling']['sample_interval']
         self.sample_count = config['sampling']['sample_count']
-
-
+        # with window set (seconds) readings are published per time window, otherwise every sample_count samples
+        self.window = config['sampling'].get('window')
+        self.percentiles = config['sampling'].get('percentiles', [])
+        # a read still running after read_timeout is counted as a missed sample (defaults to the channel's
+        # sample_interval)
+        self.read_timeout = config['sampling'].get('read_timeout')
+        self.max_workers = config['sampling'].get('max_workers', 8)
+        # how often the scheduler's jitter and overrun counts are logged (seconds)
+        self.schedule_report_interval = config['sampling'].get('schedule_report_interval', 300)
+        # alert state changes are published as events on <channel path>/alert; AlertVal (and RateAlertVal) stay in
+        # readings too unless turned off
+        self.alerts_in_readings = config.get('alerts', {}).get('in_readings', True)
 
     def do_connect(self):
+        self.codec = codec.get_codec(self.zmq_conf.get('codec', 'json'))
         self.zmq_out = context.socket(self.zmq_conf['type'])
         if self.zmq_conf["bind"]:
             self.zmq_out.bind(self.zmq_conf["address"])
         else:
             self.zmq_out.connect(self.zmq_conf["address"])
 
+    def create_sensor(self, adc, params):
+        return drivers.create(adc, params)
+
+    def create_channels(self):
+        # Load user-set thresholds from the config file
+        th_low = float(self.config['threshold']['low'])
+        th_high = float(self.config['threshold']['high'])
+
+        reporting = self.config.get('reporting', {})
+
+        channel_confs = self.config['sensing'].get('channels')
+        if not channel_confs:
+            # single sensor set by [sensing] adc - reports on the base topic
+            adc = self.config['sensing']['adc']
+            channel = Channel(adc, adc, self.create_sensor(adc, {}), "", th_low, th_high, {}, self.percentiles)
+            self.configure_channel(channel, {}, reporting, self.config.get('history', {}), self.config.get('alerts', {}))
+            return [channel]
+
+        channels = []
+        for channel_conf in channel_confs:
+            name = channel_conf['name']
+            adc = channel_conf['adc']
+            params = {key: value for key, value in channel_conf.items() if key not in CHANNEL_KEYS}
+            threshold = channel_conf.get('threshold', {})
+            sensor = self.create_sensor(adc, params)
+            channel = Channel(name, adc, sensor,
+                              channel_conf.get('topic', name),
+                              float(threshold.get('low', th_low)),
+                              float(threshold.get('high', th_high)),
+                              channel_conf.get('tags', {}),
+                              self.percentiles)
+            self.configure_channel(channel, channel_conf, {**reporting, **channel_conf.get('reporting', {})},
+                                   {**self.config.get('history', {}), **channel_conf.get('history', {})},
+                                   {**self.config.get('alerts', {}), **channel_conf.get('alerts', {})})
+            channels.append(channel)
+            logger.info("channel %s: %s %s", name, adc, params)
+        return channels
+
+    def configure_channel(self, channel, channel_conf, reporting, history, alerts):
+        channel.sample_interval = channel_conf.get('sample_interval', self.collection_interval)
+        channel.publish_interval = channel_conf.get('publish_interval', self.window)
+        channel.read_timeout = channel_conf.get('read_timeout', self.read_timeout or channel.sample_interval)
+        channel.deadband = Deadband.from_config(reporting)
+        channel.compressor = SwingingDoor.from_config(reporting)
+        if history.get('enabled', False):
+            channel.history = History(int(history.get('capacity', 600)))
+            channel.trend_window = history.get('trend_window')
+        channel.alerts = AlertEngine.from_config(alerts, channel.th_low, channel.th_high)
+        if channel.alerts is not None:
+            channel.alert_events = metrics.REGISTRY.counter("temperature_dc_alert_events_total",
+                                                            "Alert state changes published", driver=channel.adc,
+                                                            channel=channel.name)
+            if channel.alerts.needs_slope and channel.history is None:
+                logger.warning("channel %s: rate and predicted alerts need [history] enabled", channel.name)
+
     def run(self):
         logger.info("started run")
 
+        # SIGTERM (from the supervisor when the container stops) ends the loop so held readings can be sent first.
+        # It is blocked before any thread starts and taken by a thread of its own in sigwait, which wakes the loop
+        # from whatever it is waiting on, rather than by a handler that only runs once the current wait is over.
+        self.stopping = threading.Event()
+        self.reader = None
+        watch_sigterm = threading.current_thread() is threading.main_thread()  # not when run on a thread (benchmarks)
+        if watch_sigterm:
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+
         self.do_connect()
 
         # timezone determination
@@ -86,56 +214,50 @@ class TemperatureMeasureBuildingBlock(multiprocessing.Process):
         today = datetime.datetime.now().date()
         next_check = (datetime.datetime(today.year, today.month, today.day) + datetime.timedelta(days=1)).timestamp()
 
-        run = True
-        period = self.collection_interval
-
-
-        # Load user-set thresholds from the config file
-        th_low = float(self.config['threshold']['low'])
-        th_high = float(self.config['threshold']['high'])
-
-
-        if self.config['sensing']['adc'] == 'MLX90614':
-            sensor = sen.MLX90614()
-        elif self.config['sensing']['adc'] == 'W1ThermSensor':
-            sensor = sen.W1Therm()
-        elif self.config['sensing']['adc'] == 'K-type_DFRobot_MAX31855':
-            sensor = sen.k_type_DFRobot_MAX31855()
-        elif self.config['sensing']['adc'] == 'K-type_MAX6675':
-            sensor = sen.k_type_MAX6675()
-        elif self.config['sensing']['adc'] == 'AHT20':
-            sensor = sen.aht20()
-        elif self.config['sensing']['adc'] == 'SHT30':
-            sensor = sen.sht30()
-        elif self.config['sensing']['adc'] == 'PT100_arduino':
-            sensor = sen.PT100_arduino()
-        elif self.config['sensing']['adc'] == 'PT100_raspi_MAX31865':
-            sensor = sen.PT100_raspi_MAX31865()
-        elif self.config['sensing']['adc'] == 'PT100_raspi_SMHAT':
-            sensor = sen.PT100_raspi_sequentmicrosystems_HAT()
-
-        else:
-            raise Exception(f'ADC "{self.config["sensing"]["adc"]}" not recognised/supported')
-
-        num_samples = 0
-        sample_accumulator = 0
-
-        sleep_time = period
-        t = time.time()
-        while run:
-            t += period
-
-
-            # Collect samples from ADC
-            try:
-                sample = sensor.get_temperature()
-                # sample = sensor
-                logger.info("Prorcess TemperatureMeasureBuildingBlock- STAGE-3 done")
-                sample_accumulator += sample
-                num_samples+=1
-            except Exception as e:
-                logger.error(f"Sampling led to exception{e}")
-
+        metrics.REGISTRY.register("temperature_dc_cold_start_seconds", self.cold_start,
+                                  "Time from container start to the first reading", block="measure")
+        if self.metrics_conf.get('enabled', False):
+            metrics.serve(self.metrics_conf.get('measure_port', 9101), self.metrics_conf.get('host', '0.0.0.0'))
+
+        drivers.load_plugins(self.config['sensing'].get('driver_modules', []))
+        channels = self.create_channels()
+        reader = BusReader(channels, self.read_timeout or self.collection_interval, self.max_workers)
+        self.reader = reader
+        if watch_sigterm:
+            threading.Thread(target=self.wait_for_sigterm, name="sigterm", daemon=True).start()
+
+        # every channel samples and publishes on its own interval, all on one grid so related rates stay in phase
+        scheduler = Scheduler()
+        tasks = {}
+        for channel in channels:
+            tasks[f"{channel.name}/sample"] = ("sample", channel)
+            scheduler.add(f"{channel.name}/sample", channel.sample_interval)
+            if channel.publish_interval:
+                tasks[f"{channel.name}/publish"] = ("publish", channel)
+                # first publish one interval in, once there are samples to publish (same grid as at offset 0)
+                scheduler.add(f"{channel.name}/publish", channel.publish_interval, channel.publish_interval)
+        next_report = time.monotonic() + self.schedule_report_interval
+        by_name = {channel.name: channel for channel in channels}
+
+        while not self.stopping.is_set():
+            # sleep until the next task is due, handling sensor reads as they finish in the meantime
+            now = time.monotonic()
+            wake = min(scheduler.next_deadline(), reader.next_deadline())
+            if reader.wait(wake - now):
+                now = time.monotonic()
+            else:
+                self.stopping.wait(max(0.0, wake - time.monotonic()))
+                now = time.monotonic()
+
+            for name, sample in reader.collect(now).items():
+                self.add_sample(by_name[name], sample, now, tz)
+
+            due = [tasks[key] for key in scheduler.pop_due(now)]
+            # one submission per wake, so channels due together are read in one pass of their bus
+            reader.submit([channel for action, channel in due if action == "sample"], now)
+            for action, channel in due:
+                if action == "publish":
+                    self.publish(channel, tz)
 
             # handle timestamps and timezones
             if time.time() > next_check:
@@ -146,42 +268,156 @@ class TemperatureMeasureBuildingBlock(multiprocessing.Process):
                 next_check = (datetime.datetime(today.year, today.month, today.day) + datetime.timedelta(
                     days=1)).timestamp()
 
-            # dispatch messages
-            if num_samples >= self.sample_count:
-                average_sample = sample_accumulator / self.sample_count
-                num_samples = 0
-                sample_accumulator = 0
-                print(average_sample)
-                logger.info(f"temperature_reading: {average_sample}")
-
-                # Compare against thresholds 
-                if average_sample > th_high:
-                    AlertVal = 1
-                elif average_sample < th_low:
-                    AlertVal = -1
-                else:
-                    AlertVal = 0
-
-                # capture timestamp
-                timestamp = datetime.datetime.now(tz=tz).isoformat()
-
-                # convert
-                # payload = {**results, **self.constants, "timestamp": timestamp}
-                payload = {"machine": self.constants['machine'], "temp": average_sample, "AlertVal": AlertVal, "ThresholdLow": th_low, "ThresholdHigh": th_high, "sensor": self.config['sensing']['adc'], "timestamp": timestamp}
-
-                # send
-                output = {"path": "", "payload": payload}
-                self.dispatch(output)
-
-            # handle sample rate
-            if sleep_time <= 0:
-                logger.warning(f"previous loop took longer that expected by {-sleep_time}s")
-                t = t - sleep_time  # prevent free-wheeling to make up the slack
-
-            sleep_time = t - time.time()
-            time.sleep(max(0.0, sleep_time))
+            if now >= next_report:
+                next_report += self.schedule_report_interval
+                logger.info(scheduler.summary())
+        reader.close()
+        self.flush(channels)
+        # give the wrapper a moment to take what is still queued before the process exits
+        self.zmq_out.close(linger=1000)
         logger.info("done")
 
+    def wait_for_sigterm(self):
+        signal.sigwait({signal.SIGTERM})
+        self.stop()
+
+    def stop(self):
+        """end the run loop, waking it from any wait"""
+        self.stopping.set()
+        if self.reader is not None:
+            self.reader.interrupt()
+
+    def flush(self, channels):
+        """send the readings swinging door compression is still holding back, so each trend ends where it should"""
+        for channel in channels:
+            if channel.compressor is not None:
+                for released in channel.compressor.flush():
+                    channel.readings_total.inc()
+                    self.dispatch(released)
+
+    def add_sample(self, channel, sample, now, tz):
+        if isinstance(sample, MissedSample):
+            channel.missed += 1
+            channel.missed_total.inc()
+            logger.warning("Missed sample on %s: %s", channel.name, sample)
+            return
+        if isinstance(sample, Exception):
+            channel.read_errors.inc()
+            logger.error("Sampling %s led to exception %s", channel.name, sample)
+            return
+        if isinstance(sample, dict):
+            channel.quantities.add(sample)
+            sample = sample.get("temp")
+            if sample is None:
+                channel.missed += 1
+                channel.read_errors.inc()
+                logger.warning("Invalid reading on %s", channel.name)
+                return
+        channel.stats.add(sample)
+        if channel.history is not None:
+            channel.history.add(now, sample)
+        if channel.alerts is not None:
+            self.check_alerts(channel, sample, now, tz)
+        if not channel.publish_interval and channel.stats.count >= self.sample_count:
+            self.dispatch_average(channel, tz)
+
+    def check_alerts(self, channel, sample, now, tz):
+        slope = None
+        if channel.alerts.needs_slope and channel.history is not None:
+            slope = channel.history.slope(channel.trend_window)
+        changes = channel.alerts.update(sample, slope, now)
+        if not changes:
+            return
+        timestamp = datetime.datetime.now(tz=tz).isoformat()
+        path = f"{channel.path}/alert" if channel.path else "alert"
+        for alert, state, previous in changes:
+            logger.info("alert %s on %s: %s -> %s at %s", alert, channel.name, previous, state, sample)
+            payload = {"machine": self.constants['machine'], **channel.tags, "sensor": channel.adc,
+                       "channel": channel.name, "alert": alert, "state": state, "previous": previous, "temp": sample,
+                       "timestamp": timestamp}
+            threshold = channel.alerts.threshold(alert, state or previous)
+            if threshold is not None:
+                payload["threshold"] = threshold
+            if slope is not None:
+                payload["temp_slope"] = slope * 60
+            if alert == "predicted" and state != 0:
+                payload["time_to_threshold"] = channel.alerts.time_to_threshold
+            channel.alert_events.inc()
+            self.dispatch({"path": path, "payload": payload})
+
+    def publish(self, channel, tz):
+        if channel.stats.count:
+            self.dispatch_average(channel, tz)
+        else:
+            logger.warning("no samples from %s in the last %ss", channel.name, channel.publish_interval)
+
+    def dispatch_average(self, channel, tz):
+        average_sample = channel.stats.mean
+        stats = channel.stats.summary("temp")
+        channel.stats.reset()
+        quantities = channel.quantities.summary()
+        channel.quantities.reset()
+        missed = channel.missed
+        channel.missed = 0
+        logger.debug("temperature_reading %s: %s", channel.name, average_sample)
+
+        # Compare against thresholds (the alert engine's debounced state when it is enabled)
+        if channel.alerts is not None:
+            AlertVal = channel.alerts.level.state
+        elif average_sample > channel.th_high:
+            AlertVal = 1
+        elif average_sample < channel.th_low:
+            AlertVal = -1
+        else:
+            AlertVal = 0
+
+        if channel.deadband is not None and not channel.deadband.check(average_sample, AlertVal, time.monotonic()):
+            channel.missed = missed  # keep counting until a reading goes out
+            return
+
+        # capture timestamp
+        timestamp = datetime.datetime.now(tz=tz).isoformat()
+
+        # convert
+        # payload = {**results, **self.constants, "timestamp": timestamp}
+        payload = {"machine": self.constants['machine'], **channel.tags, "temp": average_sample, "ThresholdLow": channel.th_low, "ThresholdHigh": channel.th_high, "sensor": channel.adc, "channel": channel.name, **stats, **quantities, **self.trend(channel), "missed": missed, "timestamp": timestamp}
+
+        if self.alerts_in_readings:
+            payload["AlertVal"] = AlertVal
+            if channel.alerts is not None and channel.alerts.rate_limit is not None:
+                payload["RateAlertVal"] = channel.alerts.rate.state
+
+        # send
+        output = {"path": channel.path, "payload": payload}
+        if channel.compressor is not None:
+            # may release an earlier held reading (with its own timestamp) or nothing at all
+            alert_changed = channel.last_alert is not None and AlertVal != channel.last_alert
+            channel.last_alert = AlertVal
+            for released in channel.compressor.feed(time.monotonic(), average_sample, output, force=alert_changed):
+                channel.readings_total.inc()
+                self.dispatch(released)
+        else:
+            channel.readings_total.inc()
+            self.dispatch(output)
+
+    def trend(self, channel):
+        """rolling mean and slope (degrees per minute) from the channel's history"""
+        if channel.history is None:
+            return {}
+        fields = {}
+        mean = channel.history.mean(channel.trend_window)
+        if mean is not None:
+            fields["temp_rolling_mean"] = mean
+        slope = channel.history.slope(channel.trend_window)
+        if slope is not None:
+            fields["temp_slope"] = slope * 60
+        return fields
+
     def dispatch(self, output):
-        logger.info(f"dispatch to { output['path']} of {output['payload']}")
-        self.zmq_out.send_json({'path': output.get('path', ""), 'payload': output['payload']})
+        if self.cold_start.value is None:
+            self.cold_start.set(time.monotonic() - self.started)
+            logger.info("cold start: first reading dispatched %.3fs after start", self.cold_start.value)
+        logger.debug("dispatch to %s of %s", output['path'], output['payload'])
+        self.zmq_out.send(self.codec.encode({'path': output.get('path', ""), 'payload': output['payload'], 'sent': time.time()}))
+        if self.health is not None:
+            self.health.message_sent()
@@ -0,0 +1,237 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# In-process metrics. Each building block process keeps its own REGISTRY and can serve it in the Prometheus text
+# format over HTTP (see serve), e.g. for Prometheus or Telegraf's prometheus input to scrape.
+
+import bisect
+import http.server
+import logging
+import threading
+
+logger = logging.getLogger("main.metrics")
+
+# upper bounds in seconds, roughly log spaced from 1ms to 10s
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+# sensor reads can take tens of microseconds
+READ_BUCKETS = (0.0001, 0.0002, 0.0005) + LATENCY_BUCKETS
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge:
+    """Single value that is set rather than accumulated"""
+
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus style: counts per upper bound plus one overflow bucket)"""
+
+    def __init__(self, name, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q-th quantile (inf if it is in the overflow bucket)"""
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+    def summary(self):
+        if self.count == 0:
+            return f"{self.name}: no observations"
+        buckets = " ".join(f"<={bound * 1000:g}ms:{n}" for bound, n in zip(self.buckets, self.counts) if n)
+        if self.counts[-1]:
+            buckets += f" >{self.buckets[-1] * 1000:g}ms:{self.counts[-1]}"
+        return (f"{self.name}: n={self.count} mean={self.sum / self.count * 1000:.1f}ms "
+                f"p50<={self.quantile(0.5) * 1000:g}ms p99<={self.quantile(0.99) * 1000:g}ms [{buckets}]")
+
+
+class FunctionGauge:
+    """Gauge whose value is read from a function when the metrics are collected"""
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function()
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in items) + "}"
+
+
+class Registry:
+    """Metrics by Prometheus name and labels, created on first use"""
+
+    def __init__(self):
+        self.families = {}  # name -> (type, help, {labels: metric})
+        self.lock = threading.Lock()
+
+    def get(self, kind, name, help, labels, create):
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.setdefault(name, (kind, help, {}))
+            if family[0] != kind:
+                raise Exception(f'metric {name} already registered as a {family[0]}')
+            metric = family[2].get(labels)
+            if metric is None:
+                metric = family[2][labels] = create()
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self.get("counter", name, help, labels, lambda: Counter(name))
+
+    def gauge(self, name, help="", **labels):
+        return self.get("gauge", name, help, labels, lambda: Gauge(name))
+
+    def gauge_function(self, name, function, help="", **labels):
+        return self.get("gauge", name, help, labels, lambda: FunctionGauge(name, function))
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self.get("histogram", name, help, labels, lambda: Histogram(name, buckets))
+
+    def register(self, name, metric, help="", **labels):
+        """add an existing metric (e.g. a component's Histogram) under a Prometheus name"""
+        kind = {Counter: "counter", Histogram: "histogram"}.get(type(metric), "gauge")
+        return self.get(kind, name, help, labels, lambda: metric)
+
+    def exposition(self):
+        """all metrics in the Prometheus text format (version 0.0.4)"""
+        with self.lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in sorted(self.families.items())]
+        lines = []
+        for name, kind, help, metrics in families:
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == "histogram":
+                    with metric.lock:
+                        counts, count, total = list(metric.counts), metric.count, metric.sum
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + (float("inf"),), counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{format_labels(labels)} {count}")
+                else:
+                    value = metric.value
+                    if value is not None:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would otherwise log a line each
+
+
+def serve(port, host="0.0.0.0", registry=REGISTRY):
+    """serve the registry at http://host:port/metrics from a background thread"""
+    handler = type("Handler", (MetricsHandler,), {"registry": registry})
+    try:
+        server = http.server.ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        # metrics are not worth stopping the building block for
+        logger.error("unable to serve metrics on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"metrics-{port}", daemon=True).start()
+    logger.info("metrics served on http://%s:%s/metrics", host, port)
+    return server
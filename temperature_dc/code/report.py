@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Report-by-exception filters applied to each channel's readings before they are dispatched.
+
+import math
+
+
+class Deadband:
+    """
+    Passes a reading only when it has moved outside the deadband around the last published value (by more than
+    absolute degrees, or more than percent % of that value - whichever are set), when the alert state changes, or
+    when nothing has been published for heartbeat seconds.
+    """
+
+    def __init__(self, absolute=None, percent=None, heartbeat=None):
+        self.absolute = absolute
+        self.percent = percent
+        self.heartbeat = heartbeat
+
+        self.last_value = None
+        self.last_alert = None
+        self.last_time = None
+
+    @classmethod
+    def from_config(cls, conf):
+        """Deadband for a [reporting] table, or None if it sets no deadband"""
+        absolute = conf.get('deadband_abs')
+        percent = conf.get('deadband_pct')
+        if absolute is None and percent is None:
+            return None
+        return cls(absolute, percent, conf.get('heartbeat'))
+
+    def check(self, value, alert, now):
+        """True if the reading should be published (and becomes the new reference), False to drop it"""
+        if self.last_value is None or alert != self.last_alert:
+            return self.passed(value, alert, now)
+        if self.heartbeat is not None and now - self.last_time >= self.heartbeat:
+            return self.passed(value, alert, now)
+        change = abs(value - self.last_value)
+        if self.absolute is not None and change > self.absolute:
+            return self.passed(value, alert, now)
+        if self.percent is not None and change > abs(self.last_value) * self.percent / 100:
+            return self.passed(value, alert, now)
+        return False
+
+    def passed(self, value, alert, now):
+        self.last_value = value
+        self.last_alert = alert
+        self.last_time = now
+        return True
+
+
+class SwingingDoor:
+    """
+    Swinging door trending compression. Keeps only the points needed to redraw the series, by straight lines
+    between them, to within deviation of every original value. A point is held until the line from the last kept
+    point to the next one would pass further than deviation from a point in between, then it is released with its
+    own timestamp and value. max_interval bounds how long a point is held on a steady signal, and force (e.g. on a
+    change of alert state) releases the held point and the current one straight away.
+    """
+
+    def __init__(self, deviation, max_interval=None):
+        self.deviation = deviation
+        self.max_interval = max_interval
+
+        self.archived = None  # (t, value) of the last released point
+        self.held = None  # (t, value, item) of the latest point, not released yet
+        self.upper = -math.inf  # steepest slope of the door pivoting on archived value + deviation
+        self.lower = math.inf  # shallowest slope of the door pivoting on archived value - deviation
+
+    @classmethod
+    def from_config(cls, conf):
+        """SwingingDoor for a [reporting] table, or None if it does not enable compression"""
+        deviation = conf.get('compression_dev')
+        if deviation is None:
+            return None
+        return cls(deviation, conf.get('compression_max_interval'))
+
+    def archive(self, t, value):
+        self.archived = (t, value)
+        self.held = None
+        self.upper = -math.inf
+        self.lower = math.inf
+
+    def open_doors(self, t, value):
+        archived_t, archived_value = self.archived
+        dt = t - archived_t
+        if dt <= 0:
+            return True
+        self.upper = max(self.upper, (value - archived_value - self.deviation) / dt)
+        self.lower = min(self.lower, (value - archived_value + self.deviation) / dt)
+        # the straight line to this point must stay between the doors, otherwise it would pass further than
+        # deviation from an earlier point
+        return self.upper <= (value - archived_value) / dt <= self.lower
+
+    def feed(self, t, value, item, force=False):
+        """returns the items to publish now, oldest first"""
+        if self.archived is None:
+            self.archive(t, value)
+            return [item]
+
+        released = []
+        if self.held is not None:
+            held_t, held_value, held_item = self.held
+            overdue = self.max_interval is not None and t - self.archived[0] >= self.max_interval
+            if force or overdue or not self.open_doors(t, value):
+                released.append(held_item)
+                self.archive(held_t, held_value)
+                self.open_doors(t, value)
+        elif not force:
+            self.open_doors(t, value)
+
+        if force:
+            released.append(item)
+            self.archive(t, value)
+        else:
+            self.held = (t, value, item)
+        return released
+
+    def flush(self):
+        """release the held point, if any"""
+        if self.held is None:
+            return []
+        held_t, held_value, held_item = self.held
+        self.archive(held_t, held_value)
+        return [held_item]
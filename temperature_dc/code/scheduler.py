@@ -0,0 +1,105 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import heapq
+import itertools
+import logging
+import math
+import time
+import metrics
+
+logger = logging.getLogger("main.measure.scheduler")
+
+
+class Task:
+    def __init__(self, key, interval, deadline):
+        self.key = key
+        self.interval = interval
+        self.deadline = deadline
+        self.runs = 0
+        self.overruns = 0  # slots skipped because the task was a whole interval or more late
+        self.max_jitter = 0.0
+
+
+class Scheduler:
+    """
+    Runs tasks at fixed intervals on the monotonic clock, so wall clock steps (NTP, DST) do not move them. Every
+    deadline sits on its task's grid start + n * interval, so tasks with related intervals stay in phase and lateness
+    never accumulates into drift. A task less than one interval late runs straight away and keeps its grid; one that
+    is later than that runs once and skips the missed slots, which are counted as overruns.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.heap = []
+        self.order = itertools.count()  # tie break so tasks with equal deadlines never compare
+        self.tasks = {}
+        self.jitter = metrics.REGISTRY.register("temperature_dc_schedule_jitter_seconds",
+                                                metrics.Histogram("scheduling jitter"),
+                                                "How late scheduled samples and publishes ran")
+        self.overrun_total = metrics.REGISTRY.counter("temperature_dc_schedule_overruns_total",
+                                                      "Scheduled slots skipped as a task ran an interval late")
+
+    def add(self, key, interval, offset=0.0):
+        if interval <= 0:
+            raise Exception(f'interval for {key} must be positive, not {interval}')
+        task = Task(key, interval, self.start + offset)
+        self.tasks[key] = task
+        heapq.heappush(self.heap, (task.deadline, next(self.order), task))
+
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else math.inf
+
+    def pop_due(self, now=None):
+        """keys of the tasks due by now, earliest first, each rescheduled to its next slot"""
+        now = self.clock() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, task = heapq.heappop(self.heap)
+            late = now - deadline
+            self.jitter.observe(late)
+            task.max_jitter = max(task.max_jitter, late)
+            task.runs += 1
+            skipped = int(late // task.interval)
+            if skipped:
+                task.overruns += skipped
+                self.overrun_total.inc(skipped)
+                logger.debug("%s %.3fs late, skipping %s slot(s)", task.key, late, skipped)
+            task.deadline = deadline + (skipped + 1) * task.interval
+            heapq.heappush(self.heap, (task.deadline, next(self.order), task))
+            due.append(task.key)
+        return due
+
+    @property
+    def overruns(self):
+        return sum(task.overruns for task in self.tasks.values())
+
+    def summary(self):
+        late = [f"{task.key}: {task.overruns}" for task in self.tasks.values() if task.overruns]
+        return f"{self.jitter.summary()}, overruns {self.overruns}" + (f" ({', '.join(late)})" if late else "")
@@ -26,170 +26,408 @@
 #
 # ----------------------------------------------------------------------
 
-#import math                                # Not used currently
-from smbus2 import SMBus
-#from mlx90614 import MLX90614              # imported below when class is created
-#from w1thermsensor import W1ThermSensor    # imported below when class is created
-#import max6675                             # imported below when class is created
-#import MAX31865                            # imported below when class is created
-#import adafruit_ahtx0                      # imported below when class is created
-#import board                               # imported below when class is created
+import bisect
 import logging
-import importlib
-#import serial                              # imported below when class is created
-import json
+import math
+import random
+import metrics
+from drivers import register
+from traces import load_trace
 import time
 
-# import sys
-# sys.path.append(docker exec -it )
-# from DFRobot_MAX31855 import *
-
 logger = logging.getLogger("main.measure.sensor")
 
+# Each sensor class is registered under the adc name used in config.toml, along with the packages it needs;
+# those are only imported when a channel using it is created.
+# Each sensor class sets self.bus_id to the bus it talks over (e.g. "i2c-1", "spi-0").
+# Channels on the same bus are read one after another, channels on different buses are read in parallel.
+
 
 #adc_module = "DFRobot_MAX31855"
 #try:
 #    local_lib = importlib.import_module(f"adc.{adc_module}")
-#    logger.debug(f"Imported {adc_module}")
+#    logger.debug("Imported %s", adc_module)
 #except ModuleNotFoundError as e:
-#    logger.error(f"Unable to import module {adc_module}. Stopping!!")
+#    logger.error("Unable to import module %s. Stopping!!", adc_module)
 
 
 
 
 
 
+@register("K-type_DFRobot_MAX31855", requires=("smbus2", "RPi.GPIO"))
 class k_type_DFRobot_MAX31855:
     # https://github.com/DFRobot/DFRobot_MAX31855/tree/main/raspberrypi/python
-    def __init__(self):
-        import adc.DFRobot_MAX31855 as DFRobot_MAX31855
-        self.I2C_1       = 0x01
-        self.I2C_ADDRESS = 0x10
+    def __init__(self, bus=1, address=0x10):
+        from adc.DFRobot_MAX31855 import DFRobot_MAX31855
+        self.I2C_1       = bus
+        self.I2C_ADDRESS = address
         #Create MAX31855 object
         #self.max31855 = local_lib.DFRobot_MAX31855(self.I2C_1 ,self.I2C_ADDRESS)
         self.max31855 = DFRobot_MAX31855(self.I2C_1 ,self.I2C_ADDRESS)
+        self.bus_id = f"i2c-{bus}"
 
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- k_type_DFRobot_MAX31855 started")
         return self.max31855.read_celsius()
 
 
 
+@register("K-type_MAX6675", requires=("RPi.GPIO",))
 class k_type_MAX6675:
-    # https://github.com/archemius/MAX6675-Raspberry-pi-python/blob/master/temp_read_1_sensor.py
-    def __init__(self):
+    # Bit-banged on GPIO pins (cs, sck, so), several chips can share sck/so with their own cs, or on hardware SPI
+    # when spi_bus/spi_device are set. Reads never wait for a conversion, they return the latest completed one.
+    def __init__(self, cs=23, sck=24, so=25, spi_bus=None, spi_device=0, spi_speed=1000000, unit=1):
         import adc.max6675
         self.max6675 = adc.max6675
-        self.cs = 23
-        self.sck = 24
-        self.so = 25
-        self.max6675.set_pin(self.cs, self.sck, self.so, 1) #[unit : 0 - raw, 1 - Celsius, 2 - Fahrenheit]
-    
+        self.unit = unit  # [unit : 0 - raw, 1 - Celsius, 2 - Fahrenheit]
+        if spi_bus is not None:
+            self.bank = self.max6675.SpiBank.get(spi_bus, spi_device, spi_speed)
+            self.cs = spi_device
+            self.bus_id = f"spi-{spi_bus}"
+        else:
+            self.bank = self.max6675.BitBangBank.get(sck, so)
+            self.cs = cs
+            self.bus_id = f"gpio-{sck}-{so}"  # shared clock/data lines
+        self.bank.add(self.cs)
+
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- k_type_MAX6675 started")
-        return self.max6675.read_temp(self.cs)
+        return self.max6675.decode(self.bank.read(self.cs), self.unit)
 
 
+@register("MLX90614", requires=("smbus2", "mlx90614"))
 class MLX90614:
-    def __init__(self):
+    def __init__(self, bus=1, address=0x5a):
+        from smbus2 import SMBus
         from mlx90614 import MLX90614
-        self.bus = SMBus(1)
-        self.sensor=MLX90614(self.bus,address=0x5a)
+        self.bus = SMBus(bus)
+        self.sensor=MLX90614(self.bus,address=address)
+        self.bus_id = f"i2c-{bus}"
 
     def sensor_die_temp(self): # not used externally
-        logger.info("TemperatureMeasureBuildingBlock- MLX90614_self started")
         return self.sensor.get_amb_temp()
 
     def get_temperature(self): # target surface temperature via infrared 
-        logger.info("TemperatureMeasureBuildingBlock- MLX90614_IR started")
         return self.sensor.get_obj_temp()
 
 
 
+def crc8(data, polynomial=0x31, init=0xFF):
+    # Sensirion CRC-8 over a measurement word
+    crc = init
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+@register("SHT30", requires=("smbus2",))
 class sht30:
-    def __init__(self):
-        self.bus = SMBus(1)
-        self.bus.write_i2c_block_data(0x44, 0x2C, [0x06])
-        time.sleep(0.5)
-        self.data = self.bus.read_i2c_block_data(0x44, 0x00, 6)
+    # Periodic acquisition: the chip measures on its own at mps measurements per second and each read fetches the
+    # latest result (temperature and humidity, each with a CRC) in one 6 byte read. Between measurements the
+    # previous reading is returned without touching the bus.
+    QUANTITIES = {"humidity": "mean"}
+    # periodic mode commands: mps -> (MSB, LSB for high, medium, low repeatability)
+    PERIODIC = {0.5: (0x20, (0x32, 0x24, 0x2F)), 1: (0x21, (0x30, 0x26, 0x2D)), 2: (0x22, (0x36, 0x20, 0x2B)),
+                4: (0x23, (0x34, 0x22, 0x29)), 10: (0x27, (0x37, 0x21, 0x2A))}
+    REPEATABILITY = ("high", "medium", "low")
+    FETCH_DATA = (0xE0, 0x00)
+    BREAK = (0x30, 0x93)
+    # while the chip NACKs a fetch (no new measurement yet) the last reading is reused for up to this many periods,
+    # after that the error is raised so a disconnected sensor shows up as read errors rather than a frozen value
+    STALE_PERIODS = 2
+
+    def __init__(self, bus=1, address=0x44, mps=1, repeatability="high"):
+        from smbus2 import SMBus, i2c_msg
+        if mps not in self.PERIODIC:
+            raise Exception(f'SHT30 mps {mps} not supported (one of {", ".join(map(str, self.PERIODIC))})')
+        if repeatability not in self.REPEATABILITY:
+            raise Exception(f'SHT30 repeatability "{repeatability}" not recognised')
+        self.i2c_msg = i2c_msg
+        self.bus = SMBus(bus)
+        self.address = address
+        self.bus_id = f"i2c-{bus}"
+        self.period = 1 / mps
+        msb, lsbs = self.PERIODIC[mps]
+        self.bus.i2c_rdwr(i2c_msg.write(address, [msb, lsbs[self.REPEATABILITY.index(repeatability)]]))
+        self.fetched_at = time.monotonic()  # first result is ready one period after starting
+        self.reading = None
+
+    def fetch(self):
+        self.bus.i2c_rdwr(self.i2c_msg.write(self.address, self.FETCH_DATA))
+        read = self.i2c_msg.read(self.address, 6)
+        self.bus.i2c_rdwr(read)
+        data = list(read)
+        if crc8(data[0:2]) != data[2] or crc8(data[3:5]) != data[5]:
+            raise ValueError("SHT30 CRC mismatch")
+        return {"temp": -45 + 175 * (data[0] << 8 | data[1]) / 65535.0,
+                "humidity": 100 * (data[3] << 8 | data[4]) / 65535.0}
+
+    def get_reading(self):
+        now = time.monotonic()
+        if self.reading is None and now - self.fetched_at < self.period:
+            # the chip would NACK a fetch until its first measurement is done
+            raise ValueError(f"SHT30 first measurement not ready ({self.period - (now - self.fetched_at):.2f}s to go)")
+        if self.reading is None or now - self.fetched_at >= self.period:
+            try:
+                self.reading = self.fetch()
+                self.fetched_at = now
+            except OSError:
+                # NACK: no new measurement yet
+                if self.reading is None or now - self.fetched_at >= self.STALE_PERIODS * self.period:
+                    raise
+        return self.reading
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- SHT30 started")
-        self.temp = self.data[0] * 256 + self.data[1]
-        return -45 + (175 * self.temp / 65535.0)
+        return self.get_reading()["temp"]
 
+    def close(self):
+        self.bus.i2c_rdwr(self.i2c_msg.write(self.address, self.BREAK))
+        self.bus.close()
 
 
+@register("W1ThermSensor", requires=("w1thermsensor",))
 class W1Therm:
-    def __init__(self):
+    def __init__(self, sensor_id=None):
         from w1thermsensor import W1ThermSensor
-        self.sensor = W1ThermSensor()
+        self.sensor = W1ThermSensor(sensor_id=sensor_id)
+        self.bus_id = "w1"
 
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- w1therm started")
         return self.sensor.get_temperature()
 
 
 
+@register("PT100_arduino", requires=("serial",))
 class PT100_arduino:
-
-    def __init__(self):
-        import serial
-        self.ser = serial.Serial(port='/dev/ttyACM0', baudrate=115200, timeout=1)
+    # The Arduino streams JSON lines, read continuously in the background. Several channels can take different
+    # fields of the same port's lines.
+    def __init__(self, port='/dev/ttyACM0', baudrate=115200, field="T", buffer=64, max_age=5):
+        from adc.serial_stream import SerialStream
+        self.stream = SerialStream.get(port, baudrate, buffer)
+        self.field = field
+        self.max_age = max_age if max_age is not None and max_age > 0 else None  # 0 or less: never expire
+        self.bus_id = f"serial-{port}"
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- PT100_arduino started")
-        with self.ser as ser:
-            if ser.isOpen():
-                ser.flushInput()
-                time.sleep(0.5)
-                data_string = ser.readline().decode('utf-8').strip()
-                data = json.loads(data_string)
-                self.reading = data["T"]
-        return self.reading
+        # a non-numeric value (e.g. "err") raises here, as a read error, rather than reaching the window stats
+        return float(self.stream.latest(self.field, self.max_age))
+
+    def get_window(self, n):
+        return [float(value) for value in self.stream.window(self.field, n)]
 
     def close(self):
-        self.ser.close()
+        self.stream.release()
 
 
+@register("PT100_raspi_MAX31865", requires=("spidev",))
 class PT100_raspi_MAX31865:
+    # Continuous conversion, read in one register burst at most once per conversion (or when DRDY says there is a
+    # new one). Several boards can share a bus: each on its own spi_cs, or on a GPIO chip select with cs_pin.
+    QUANTITIES = {"fault": "or"}
 
-    def __init__(self):
+    def __init__(self, spi_bus=0, spi_cs=0, r_ref=438, r_0=100, spi_speed=1000000, cs_pin=None, drdy_pin=None,
+                 filter50Hz=1, linearisation="cvd"):
         import adc.MAX31865 as MAX31865
-        self.MyMax = MAX31865.max31865()
-        self.MyMax.set_config(VBias=1, continous=1, filter50Hz=1)
-        self.MyRTD = MAX31865.PT_RTD(100)
+        self.MyMax = MAX31865.max31865(R_Ref=r_ref, spi_bus=spi_bus, spi_cs=spi_cs, spi_speed=spi_speed,
+                                       cs_pin=cs_pin, drdy_pin=drdy_pin)
+        self.bus_id = f"spi-{spi_bus}"
+        self.MyMax.set_config(VBias=1, continous=1, filter50Hz=filter50Hz)
+        self.MyRTD = MAX31865.PT_RTD(r_0)
+        if linearisation == "quadratic":
+            self.convert = self.MyRTD.calculate_temperature_quadratic
+        elif linearisation == "cvd":
+            self.convert = self.MyRTD.calculate_temperature_cvd
+        else:
+            raise Exception(f'MAX31865 linearisation "{linearisation}" not recognised/supported')
+
+    def get_reading(self):
+        adc_code, fault = self.MyMax.read_all()
+        if fault:
+            return {"temp": None, "fault": fault}
+        return {"temp": self.convert(self.MyMax.calculate_resistance(adc_code)), "fault": 0}
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- PT100_raspi_MAX31865 started")
-        return self.MyRTD(self.MyMax())
+        reading = self.get_reading()
+        if reading["temp"] is None:
+            raise ValueError(f"MAX31865 fault status {reading['fault']:#04x}")
+        return reading["temp"]
 
     def close(self):
         self.MyMax.spi.close()
 
 
+class SMHATPoller:
+    # One per I2C bus, shared by every SMHAT channel on it. The first channel read in a cycle scans every registered
+    # card (one block transaction each); the other channels are served from that scan until it is max_age old.
+    pollers = {}
+
+    @classmethod
+    def get(cls, bus, max_age):
+        if bus not in cls.pollers:
+            cls.pollers[bus] = cls(bus, max_age)
+        poller = cls.pollers[bus]
+        poller.max_age = min(poller.max_age, max_age)
+        return poller
+
+    def __init__(self, bus, max_age):
+        import threading
+        import adc.rtd_cards as rtd_cards
+        self.rtd_cards = rtd_cards
+        self.cards = rtd_cards.RTDCards(bus)
+        self.max_age = max_age
+        self.stacks = set()
+        self.converters = {}  # linearisation -> batch conversion used by at least one channel
+        self.readings = {}
+        self.read_at = None
+        self.lock = threading.Lock()
+        self.transactions = metrics.REGISTRY.counter("temperature_dc_bus_transactions_total",
+                                                     "Bus transactions made by shared pollers", bus=f"i2c-{bus}")
+
+    def register(self, stack, linearisation):
+        if linearisation == "poly5":
+            self.converters[linearisation] = self.rtd_cards.poly5_all
+        elif linearisation == "cvd":
+            from linearise import rtd_table
+            self.converters[linearisation] = rtd_table(100).temperatures
+        else:
+            raise Exception(f'SMHAT linearisation "{linearisation}" not recognised/supported')
+        self.stacks.add(stack)
+        self.read_at = None
+
+    def temperature(self, stack, channel, linearisation):
+        with self.lock:
+            now = time.monotonic()
+            if self.read_at is None or now - self.read_at >= self.max_age:
+                stacks = sorted(self.stacks)
+                resistances = {stack: self.cards.read_resistances(stack) for stack in stacks}
+                self.transactions.inc(len(stacks))
+                self.readings = {name: self.cards.convert(resistances, convert)
+                                 for name, convert in self.converters.items()}
+                self.read_at = now
+            temperature = self.readings[linearisation][stack][channel - 1]
+        # batch conversions give NaN for a resistance out of range (open or shorted RTD) rather than raising
+        if not math.isfinite(temperature):
+            raise ValueError(f"SMHAT stack {stack} channel {channel} resistance out of range (open or shorted RTD)")
+        return temperature
+
+
+@register("PT100_raspi_SMHAT", requires=("smbus2",))
 class PT100_raspi_sequentmicrosystems_HAT:
 
-    def __init__(self):
-        import adc.SequentMicrosystemsRTDHAT as RTDHAT
-        self.RTD_ADC = RTDHAT
+    def __init__(self, stack=0, channel=6, bus=1, max_age=0.1, linearisation="poly5"):
+        if channel < 1 or channel > 8:
+            raise Exception(f'SMHAT channel {channel} not supported, must be 1-8')
+        self.stack = stack
+        self.channel = channel
+        self.linearisation = linearisation
+        self.poller = SMHATPoller.get(bus, max_age)
+        self.poller.register(stack, linearisation)
+        self.bus_id = f"i2c-{bus}"
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- PT100_raspi_sequentmicrosystems_HAT started")
-        return self.RTD_ADC.get_poly5(0, 6) # hard coding first layer, channel "RTD6". To be made configurable.
+        return self.poller.temperature(self.stack, self.channel, self.linearisation)
 
 
+@register("AHT20", requires=("board", "adafruit_ahtx0"))
 class aht20:
-    def __init__(self):
+    QUANTITIES = {"humidity": "mean"}
+
+    def __init__(self, address=0x38):
         import board
         import adafruit_ahtx0
         # self.bus = SMBus(1)
         # self.sensor=adafruit_ahtx0.AHTx0(self.bus,address=0x38)
         i2c = board.I2C()
-        self.sensor = adafruit_ahtx0.AHTx0(i2c)
+        self.sensor = adafruit_ahtx0.AHTx0(i2c, address=address)
+        self.bus_id = "i2c-1"
+
+    def get_reading(self):
+        # the temperature and relative_humidity properties each trigger a measurement, so take one and read both.
+        # _readdata, _temp and _humidity are private to adafruit_ahtx0, which is pinned in requirements.txt for that
+        self.sensor._readdata()
+        return {"temp": self.sensor._temp, "humidity": self.sensor._humidity}
+
+    def get_temperature(self):
+        return self.get_reading()["temp"]
+
+
+@register("Simulated")
+class Simulated:
+    # Hardware-free source for load testing: a waveform plus gaussian noise, with optional read latency and
+    # dropouts (reads that raise, as a failing sensor would)
+    WAVEFORMS = ("constant", "sine", "square", "ramp", "random_walk")
+
+    def __init__(self, waveform="sine", mean=20.0, amplitude=5.0, period=60.0, noise=0.1,
+                 latency=0.0, latency_jitter=0.0, dropout=0.0, seed=None, bus=None):
+        if waveform not in self.WAVEFORMS:
+            raise Exception(f'Simulated waveform "{waveform}" not recognised/supported')
+        self.random = random.Random(seed)
+        self.waveform = waveform
+        self.mean = mean
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.dropout = dropout
+        self.walk = 0.0
+        self.start = time.monotonic()
+        # simulated channels don't share a bus unless told to
+        self.bus_id = f"sim-{bus if bus is not None else id(self)}"
+
+    def value(self, t):
+        phase = (t % self.period) / self.period
+        if self.waveform == "sine":
+            return self.mean + self.amplitude * math.sin(2 * math.pi * phase)
+        if self.waveform == "square":
+            return self.mean + (self.amplitude if phase < 0.5 else -self.amplitude)
+        if self.waveform == "ramp":
+            return self.mean + self.amplitude * (2 * phase - 1)
+        if self.waveform == "random_walk":
+            self.walk = max(-self.amplitude, min(self.amplitude, self.walk + self.random.gauss(0, self.amplitude / 20)))
+            return self.mean + self.walk
+        return self.mean
+
+    def get_temperature(self):
+        delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.dropout and self.random.random() < self.dropout:
+            raise Exception("simulated dropout")
+        return self.value(time.monotonic() - self.start) + self.random.gauss(0, self.noise)
+
+
+@register("Replay")
+class Replay:
+    # Plays back a recorded trace: CSV (timestamp,value rows) or JSONL (objects with timestamp and temp), timestamps
+    # as epoch seconds or ISO 8601. speed > 1 plays it back faster than it was recorded.
+    def __init__(self, path, speed=1.0, loop=True, field="temp", bus=None):
+        self.trace = self.load(path, field)
+        if not self.trace:
+            raise Exception(f"Replay trace {path} has no readings")
+        self.times = [t for t, _ in self.trace]
+        self.duration = self.times[-1]
+        self.speed = speed
+        self.loop = loop
+        self.start = time.monotonic()
+        self.bus_id = f"replay-{bus if bus is not None else id(self)}"
+
+    @staticmethod
+    def load(path, field):
+        # times relative to the first reading
+        trace = load_trace(path, field)
+        if trace:
+            t0 = trace[0][0]
+            trace = [(t - t0, value) for t, value in trace]
+        return trace
 
     def get_temperature(self):
-        logger.info("TemperatureMeasureBuildingBlock- aht20 started")
-        return self.sensor.temperature
+        position = (time.monotonic() - self.start) * self.speed
+        if position > self.duration:
+            if not self.loop:
+                raise Exception("end of replay trace")
+            position = position % self.duration if self.duration > 0 else 0
+        return self.trace[bisect.bisect_right(self.times, position) - 1][1]
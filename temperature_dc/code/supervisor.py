@@ -0,0 +1,232 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import datetime
+import logging
+import multiprocessing
+import multiprocessing.connection
+import time
+import codec
+import zmq
+
+logger = logging.getLogger("main.supervisor")
+
+
+class Health:
+    """
+    Counters the building blocks update and the supervisor reads, held in shared memory (multiprocessing.Value) so
+    they outlive any one process. Create before the building blocks start.
+    """
+
+    def __init__(self):
+        self.last_reading = multiprocessing.Value('d', 0.0)  # monotonic time measure last dispatched a reading
+        self.last_received = multiprocessing.Value('d', 0.0)  # monotonic time the wrapper last took a message
+        self.sent = multiprocessing.Value('Q', 0)  # messages pushed to the wrapper
+        self.received = multiprocessing.Value('Q', 0)  # messages the wrapper has taken
+
+    def message_sent(self, reading=True):
+        with self.sent.get_lock():
+            self.sent.value += 1
+        if reading:
+            self.last_reading.value = time.monotonic()
+
+    def message_received(self):
+        with self.received.get_lock():
+            self.received.value += 1
+        self.last_received.value = time.monotonic()
+
+    def queue_depth(self):
+        """messages pushed but not yet taken by the wrapper (approximate across wrapper restarts)"""
+        return max(0, self.sent.value - self.received.value)
+
+    def resync(self):
+        # messages held by a wrapper that died are lost, stop counting them as queued
+        with self.received.get_lock():
+            self.received.value = self.sent.value
+
+    def activity(self, name):
+        """monotonic time a block last showed it was working, 0 if never"""
+        return {"measure": self.last_reading, "wrapper": self.last_received}[name].value
+
+
+class Block:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.exitcode = None
+        self.died_at = None
+        self.restart_at = None
+        self.backoff = 0.0
+        self.recovery_time = None
+
+
+class Supervisor:
+    """
+    Starts the building blocks and restarts any that exit. It waits on the process sentinels, so a death is seen
+    immediately. A fresh process is built from the block's factory, so it binds or connects its ZMQ sockets again.
+    The first restart happens at once. Later restarts back off exponentially up to max_backoff, and the backoff
+    resets once a block has run for stable_time. Recovery time (death to the restarted block's first activity) is
+    logged and published with the rest of each block's health.
+    """
+
+    def __init__(self, factories, health, config, health_conf=None):
+        self.blocks = {name: Block(name, factory) for name, factory in factories.items()}
+        self.health = health
+        self.constants = config['constants']
+
+        supervisor_conf = config.get('supervisor', {})
+        self.initial_backoff = supervisor_conf.get('restart_initial', 0.5)
+        self.backoff_factor = supervisor_conf.get('restart_backoff', 2)
+        self.max_backoff = supervisor_conf.get('restart_limit', 30)
+        self.stable_time = supervisor_conf.get('stable_time', 60)
+        self.health_interval = supervisor_conf.get('health_interval', 60)
+        self.health_path = supervisor_conf.get('health_path', 'health')
+        self.stop_grace = supervisor_conf.get('stop_grace', 5)
+
+        # health messages go into the wrapper's input like readings do
+        self.health_conf = health_conf
+        self.zmq_out = None
+        self.codec = None
+
+    def start(self, processes=None):
+        """start every block, or adopt already created (not yet started) processes"""
+        processes = processes or {}
+        for block in self.blocks.values():
+            block.process = processes.get(block.name) or block.factory()
+            block.process.start()
+            block.started_at = time.monotonic()
+        if self.health_conf is not None:
+            self.codec = codec.get_codec(self.health_conf.get('codec', 'json'))
+            self.zmq_out = zmq.Context.instance().socket(zmq.PUSH)
+            self.zmq_out.connect(self.health_conf['address'])
+
+    def check(self, now):
+        for block in self.blocks.values():
+            if block.restart_at is not None:
+                if now >= block.restart_at:
+                    self.restart(block, now)
+                continue
+
+            if block.process.is_alive():
+                if block.died_at is not None and self.health.activity(block.name) > block.started_at:
+                    block.recovery_time = self.health.activity(block.name) - block.died_at
+                    block.died_at = None
+                    logger.info("%s recovered %.3fs after it stopped", block.name, block.recovery_time)
+                if block.backoff and now - block.started_at >= self.stable_time:
+                    block.backoff = 0.0
+                continue
+
+            block.process.join(0)
+            block.exitcode = block.process.exitcode
+            block.died_at = now
+            block.restart_at = now + block.backoff
+            logger.error("%s stopped with exit code %s, restarting in %.1fs", block.name, block.exitcode, block.backoff)
+            block.backoff = min(self.max_backoff, max(self.initial_backoff, block.backoff * self.backoff_factor))
+
+    def restart(self, block, now):
+        block.restart_at = None
+        try:
+            block.process = block.factory(started=now)
+            block.process.start()
+        except Exception as e:
+            logger.error("restarting %s failed: %s", block.name, e)
+            block.restart_at = now + block.backoff
+            return
+        block.started_at = now
+        block.restarts += 1
+        if block.name == "wrapper":
+            self.health.resync()
+        logger.info("%s restarted (pid %s, restart %s)", block.name, block.process.pid, block.restarts)
+
+    def block_health(self, block, now):
+        payload = {"machine": self.constants['machine'], "block": block.name,
+                   "alive": int(block.restart_at is None and block.process.is_alive()),
+                   "restarts": block.restarts, "queue_depth": self.health.queue_depth()}
+        activity = self.health.activity(block.name)
+        if activity:
+            payload["last_activity_age"] = max(0.0, now - activity)
+        if block.exitcode is not None:
+            payload["exitcode"] = block.exitcode
+        if block.recovery_time is not None:
+            payload["recovery_time"] = block.recovery_time
+        payload["timestamp"] = datetime.datetime.now().astimezone().isoformat()
+        return payload
+
+    def publish_health(self, now):
+        for block in self.blocks.values():
+            payload = self.block_health(block, now)
+            logger.info("health %s", payload)
+            if self.zmq_out is not None:
+                self.health.message_sent(reading=False)
+                self.zmq_out.send(self.codec.encode({'path': self.health_path, 'payload': payload,
+                                                     'sent': time.time()}))
+
+    def stop(self):
+        """
+        Stops the blocks in pipeline order (measure, then the wrapper). Each is sent SIGTERM and given stop_grace
+        seconds to exit, and the wrapper is left running until it has taken the messages measure sent on its way out.
+        """
+        for block in self.blocks.values():
+            block.restart_at = None
+            if block.process is None or not block.process.is_alive():
+                continue
+            if block.name == "wrapper":
+                deadline = time.monotonic() + self.stop_grace
+                while self.health.queue_depth() and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                time.sleep(0.2)  # for the last of them to be published
+            block.process.terminate()
+            block.process.join(self.stop_grace)
+            if block.process.is_alive():
+                logger.error("%s did not stop within %ss, killing it", block.name, self.stop_grace)
+                block.process.kill()
+                block.process.join()
+            logger.info("%s stopped", block.name)
+
+    def run(self):
+        next_health = time.monotonic() + self.health_interval
+        while True:
+            now = time.monotonic()
+            self.check(now)
+            if now >= next_health:
+                next_health += self.health_interval
+                self.publish_health(now)
+
+            # sleep until a block exits, a restart is due, or it's time to check for recovery/health again
+            now = time.monotonic()
+            wake = min([next_health, now + 1.0] +
+                       [block.restart_at for block in self.blocks.values() if block.restart_at is not None])
+            sentinels = [block.process.sentinel for block in self.blocks.values()
+                         if block.restart_at is None and block.process.is_alive()]
+            if sentinels:
+                multiprocessing.connection.wait(sentinels, timeout=max(0.0, wake - now))
+            else:
+                time.sleep(max(0.0, wake - now))
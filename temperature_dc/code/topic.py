@@ -0,0 +1,121 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+import functools
+import logging
+import re
+from urllib.parse import urljoin
+
+import chevron
+
+logger = logging.getLogger("main.wrapper.topic")
+
+# a template made only of {{name}} tags can be rendered with str.format, anything fancier (including {{{name}}},
+# {{&name}} and sections) goes through chevron
+SIMPLE_TAG = re.compile(r"(?<!{){{\s*([\w-]+)\s*}}(?!})")
+ANY_TAG = re.compile(r"{{")
+
+
+def html_escape(value):
+    """same value chevron renders for {{name}}: falsy values other than 0 and False are empty, the rest escaped"""
+    if value not in (0, False) and not value:
+        return ""
+    return str(value).replace("&", "&amp;").replace('"', "&quot;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class CompiledTemplate:
+    def __init__(self, template, constants):
+        self.template = template
+        self.variables = ()  # payload keys the template needs, in format order
+        self.format = None
+
+        names = SIMPLE_TAG.findall(template)
+        if len(ANY_TAG.findall(template)) != len(names):
+            logger.info("topic template %s uses more than simple tags - rendering with chevron", template)
+            return
+
+        # constants take precedence over payload values (as in {**payload, **constants}) so render them now
+        parts = []
+        variables = []
+        position = 0
+        for match in SIMPLE_TAG.finditer(template):
+            parts.append(template[position:match.start()].replace("{", "{{").replace("}", "}}"))
+            name = match.group(1)
+            if name in constants:
+                parts.append(html_escape(constants[name]).replace("{", "{{").replace("}", "}}"))
+            else:
+                parts.append("{}")
+                variables.append(name)
+            position = match.end()
+        parts.append(template[position:].replace("{", "{{").replace("}", "}}"))
+        self.format = "".join(parts)
+        self.variables = tuple(variables)
+
+    def render(self, values):
+        return self.format.format(*[html_escape(value) for value in values])
+
+
+class TopicRenderer:
+    """
+    Renders the topic for a message path and payload. The base template joined with each path is compiled once,
+    and rendered topics are kept in an LRU cache keyed by the path and the payload values the template uses,
+    so the common case is a tuple build and a dict lookup.
+    """
+
+    def __init__(self, topic_base, constants, cache_size=1024):
+        self.topic_base = topic_base
+        self.constants = constants
+        self.compiled = {}  # path -> CompiledTemplate
+        self.render_cached = functools.lru_cache(maxsize=cache_size)(self._render)
+
+    def topic_join(self, path):
+        # channel paths are nested under the base topic rather than replacing its last level
+        if not path:
+            return self.topic_base
+        return urljoin(self.topic_base + "/", path)
+
+    def compile(self, path):
+        compiled = self.compiled.get(path)
+        if compiled is None:
+            compiled = CompiledTemplate(self.topic_join(path), self.constants)
+            self.compiled[path] = compiled
+        return compiled
+
+    def _render(self, path, values, _types):
+        return self.compile(path).render(values)
+
+    def render(self, path, payload):
+        compiled = self.compile(path)
+        if compiled.format is None:
+            return chevron.render(compiled.template, {**payload, **self.constants})
+        values = tuple(payload.get(name) for name in compiled.variables)
+        try:
+            # types are part of the key because 1, 1.0 and True are equal but render differently
+            return self.render_cached(path, values, tuple(map(type, values)))
+        except TypeError:  # unhashable value (list/dict) - render without caching
+            return compiled.render(values)
@@ -0,0 +1,61 @@
+# ----------------------------------------------------------------------
+#
+#    Temperature Monitoring (Basic solution) -- This digital solution enables, measures,
+#    reports and records different  types of temperatures (contact, air, radiated)
+#    so that the temperature conditions surrounding a process can be understood and 
+#    taken action upon. Suppored sensors include 
+#    k-type thermocouples, RTDs, air samplers, and NIR-based sensors.
+#    The solution provides a Grafana dashboard that 
+#    displays the temperature timeseries, set threshold value, and a state timeline showing 
+#    the chnage in temperature. An InfluxDB database is used to store timestamp, temperature, 
+#    threshold and status. 
+#
+#    Copyright (C) 2022  Shoestring and University of Cambridge
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see https://www.gnu.org/licenses/.
+#
+# ----------------------------------------------------------------------
+
+# Recorded temperature traces, as played back by the Replay sensor and used by benchmarks/bench_compression.py.
+# CSV files hold timestamp,value rows; JSONL files one reading per line with "timestamp" and the value field.
+# Timestamps are epoch seconds or ISO 8601 - e.g. readings exported from InfluxDB.
+
+import csv
+import datetime
+import json
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def load_trace(path, field="temp"):
+    """(timestamp, value) pairs from a trace file, sorted by time. CSV headers and blank lines are skipped."""
+    points = []
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    reading = json.loads(line)
+                    points.append((parse_time(reading["timestamp"]), float(reading[field])))
+        else:
+            for row in csv.reader(f):
+                try:
+                    points.append((parse_time(row[0]), float(row[1])))
+                except (ValueError, IndexError):
+                    continue  # header or blank line
+    points.sort()
+    return points
@@ -31,34 +31,72 @@ import multiprocessing
 import logging
 import zmq
 import json
-import chevron
 import time
-from urllib.parse import urljoin
+import threading
+import metrics
+import codec
+from topic import TopicRenderer
+from buffer import DiskBuffer
 
 context = zmq.Context()
 logger = logging.getLogger("main.wrapper")
 
 
 class MQTTServiceWrapper(multiprocessing.Process):
-    def __init__(self, config, zmq_conf):
+    def __init__(self, config, zmq_conf, started=None, health=None):
         super().__init__()
 
+        # monotonic time the container's main process started, for the cold start metric
+        self.started = time.monotonic() if started is None else started
+        self.health = health  # shared with the supervisor in main
+        self.metrics_conf = config.get('metrics', {})
+        self.cold_start = metrics.Gauge("time to first reading published")
+
         mqtt_conf = config['mqtt']
         self.url = mqtt_conf['broker']
         self.port = int(mqtt_conf['port'])
 
         self.topic_base = mqtt_conf['base_topic_template']
+        self.topic_cache_size = int(mqtt_conf.get('topic_cache_size', 1024))
 
         self.initial = mqtt_conf['reconnect']['initial']
         self.backoff = mqtt_conf['reconnect']['backoff']
         self.limit = mqtt_conf['reconnect']['limit']
         self.constants = config['constants']
 
+        # batching - readings are collected per topic and published as one JSON array when either
+        # max_messages readings are waiting or the oldest has waited max_linger seconds (max_messages = 1 disables)
+        batch_conf = mqtt_conf.get('batch', {})
+        self.batch_max_messages = int(batch_conf.get('max_messages', 1))
+        self.batch_max_linger = float(batch_conf.get('max_linger', 1))
+
+        # "poll" services ZMQ and MQTT alternately in one thread, "threaded" runs the MQTT network loop in its
+        # own thread (loop_start) and blocks on ZMQ, so readings are published as soon as they arrive
+        self.loop_mode = mqtt_conf.get('loop_mode', 'poll')
+        if self.loop_mode not in ('poll', 'threaded'):
+            raise Exception(f'mqtt loop_mode "{self.loop_mode}" not recognised/supported')
+        self.threaded = self.loop_mode == 'threaded'
+        self.latency_report_interval = float(mqtt_conf.get('latency_report_interval', 60))
+
+        # store and forward - readings that can't be published while the broker is unreachable are kept on disk
+        # and replayed after reconnecting, at no more than replay_rate messages a second
+        self.buffer_conf = mqtt_conf.get('buffer', {})
+        self.replay_rate = float(self.buffer_conf.get('replay_rate', 100))
+        self.replay_batch = int(self.buffer_conf.get('replay_batch', 50))
+
         # declarations
         self.zmq_conf = zmq_conf
         self.zmq_in = None
+        self.codec = None
+        self.buffer = None
+        self.dropped = 0
+        self.connected = False
+        self.timeout = self.initial  # current reconnect backoff
+        self.next_connect = None  # monotonic time of the next connection attempt (poll mode)
+        self.next_replay = 0
 
     def do_connect(self):
+        self.codec = codec.get_codec(self.zmq_conf.get('codec', 'json'))
         self.zmq_in = context.socket(self.zmq_conf['type'])
         if self.zmq_conf["bind"]:
             self.zmq_in.bind(self.zmq_conf["address"])
@@ -66,54 +104,230 @@ class MQTTServiceWrapper(multiprocessing.Process):
             self.zmq_in.connect(self.zmq_conf["address"])
 
     def mqtt_connect(self, client, first_time=False):
-        timeout = self.initial
-        exceptions = True
-        while exceptions:
-            try:
-                if first_time:
-                    client.connect(self.url, self.port, 60)
-                else:
-                    logger.error("Attempting to reconnect...")
-                    client.reconnect()
-                logger.info("Connected!")
-                time.sleep(self.initial)  # to give things time to settle
-                exceptions = False
-            except Exception:
-                logger.error(f"Unable to connect, retrying in {timeout} seconds")
-                time.sleep(timeout)
-                if timeout < self.limit:
-                    timeout = timeout * self.backoff
-                else:
-                    timeout = self.limit
+        """
+        Makes one connection attempt. On failure the next attempt is scheduled with backoff and picked up by the
+        receive loop, so readings keep being taken off the ZMQ socket (and buffered) while the broker is away.
+        """
+        try:
+            if first_time:
+                client.connect(self.url, self.port, 60)
+            else:
+                logger.error("Attempting to reconnect...")
+                client.reconnect()
+            self.next_connect = None
+            return True
+        except Exception:
+            logger.error("Unable to connect, retrying in %s seconds", self.timeout)
+            self.next_connect = time.monotonic() + self.timeout
+            if self.timeout < self.limit:
+                self.timeout = self.timeout * self.backoff
+            else:
+                self.timeout = self.limit
+            return False
+
+    def on_connect(self, _client, _userdata, _flags, rc):
+        if rc == 0:
+            logger.info("Connected!")
+            self.mqtt_connects.inc()
+            self.connected = True
+            self.timeout = self.initial
+            if self.has_buffered():
+                logger.info("replaying %s bytes of buffered readings", self.buffer.pending_bytes)
+        else:
+            logger.error("Connection refused by broker (rc:%s)", rc)
 
     def on_disconnect(self, client, _userdata, rc):
+        self.connected = False
+        self.mqtt_disconnects.inc()
         if rc != 0:
-            logger.error(f"Unexpected MQTT disconnection (rc:{rc}), reconnecting...")
-            self.mqtt_connect(client)
+            if self.threaded:
+                # the network thread started by loop_start reconnects by itself (with reconnect_delay_set backoff)
+                logger.error("Unexpected MQTT disconnection (rc:%s), network thread will reconnect", rc)
+            else:
+                logger.error("Unexpected MQTT disconnection (rc:%s), reconnecting...", rc)
+                self.next_connect = time.monotonic()
+
+    def has_buffered(self):
+        """True when a disk buffer is configured and holds readings to replay"""
+        return self.buffer is not None and not self.buffer.is_empty()
+
+    def store(self, topic, payload):
+        """keep a reading that could not be published"""
+        if self.buffer is not None:
+            self.buffer.append(topic, payload)
+            self.buffered.inc()
+        else:
+            self.dropped += 1
+            self.dropped_total.inc()
+            logger.debug("not connected, dropped reading for %s (%s dropped so far)", topic, self.dropped)
+
+    def replay(self, client):
+        """publish the next batch of buffered readings, at no more than replay_rate messages a second"""
+        now = time.monotonic()
+        if now < self.next_replay:
+            return
+        records = self.buffer.read(self.replay_batch)
+        published = 0
+        for topic, payload in records:
+            if not self.connected or client.publish(topic, payload).rc != mqtt.MQTT_ERR_SUCCESS:
+                break
+            published += 1
+            self.bytes_sent.inc(len(payload))
+        self.buffer.commit(published)
+        self.next_replay = now + max(published, 1) / self.replay_rate
+        if not records:
+            logger.info("buffered readings replayed")
+
+    def publish(self, client, topic, payload, sent):
+        """publish and remember when its readings left the measure block, for the latency histogram"""
+        if not self.connected:
+            self.store(topic, payload)
+            return
+        info = client.publish(topic, payload)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.store(topic, payload)
+            return
+        self.messages_sent.inc()
+        self.bytes_sent.inc(len(payload))
+        if self.cold_start.value is None:
+            self.cold_start.set(time.monotonic() - self.started)
+            logger.info("cold start: first reading published %.3fs after start", self.cold_start.value)
+        # on_publish can run before publish returns (inside it in poll mode, on the network thread when threaded)
+        with self.in_flight_lock:
+            published = self.published_early.pop(info.mid, None)
+            if published is None:
+                self.in_flight[info.mid] = sent
+                return
+        self.observe_latency(published, sent)
+
+    def on_publish(self, _client, _userdata, mid):
+        # for QoS 0 this fires once the packet has been written to the broker's socket
+        now = time.time()
+        with self.in_flight_lock:
+            if mid not in self.in_flight:
+                self.published_early[mid] = now
+                return
+            sent = self.in_flight.pop(mid)
+        self.observe_latency(now, sent)
+
+    def observe_latency(self, published, sent):
+        if sent:
+            for t in sent:
+                self.latency.observe(published - t)
+                self.latency_total.observe(published - t)
+        if published >= self.next_latency_report:
+            logger.info(self.latency.summary())
+            self.latency.reset()
+            self.next_latency_report = published + self.latency_report_interval
+
+    def setup_metrics(self):
+        registry = metrics.REGISTRY
+        # latency is reset after each log report, latency_total is the cumulative histogram that gets scraped
+        self.latency_total = registry.histogram("temperature_dc_publish_latency_seconds",
+                                                "Time from a reading leaving measure to it being written to the broker")
+        self.mqtt_connects = registry.counter("temperature_dc_mqtt_connects_total", "Successful MQTT connections")
+        self.mqtt_disconnects = registry.counter("temperature_dc_mqtt_disconnects_total", "MQTT disconnections")
+        self.messages_sent = registry.counter("temperature_dc_mqtt_messages_total", "MQTT messages published")
+        self.bytes_sent = registry.counter("temperature_dc_mqtt_payload_bytes_total", "MQTT payload bytes published")
+        self.buffered = registry.counter("temperature_dc_buffered_total", "Messages stored to the disk buffer")
+        self.dropped_total = registry.counter("temperature_dc_dropped_total", "Messages dropped while disconnected")
+        registry.register("temperature_dc_cold_start_seconds", self.cold_start,
+                          "Time from container start to the first reading", block="wrapper")
+        if self.health is not None:
+            registry.gauge_function("temperature_dc_queue_depth", self.health.queue_depth,
+                                    "Messages sent by measure not yet taken by the wrapper")
+        if self.metrics_conf.get('enabled', False):
+            metrics.serve(self.metrics_conf.get('wrapper_port', 9102), self.metrics_conf.get('host', '0.0.0.0'))
 
     def run(self):
         self.do_connect()
+        self.setup_metrics()
+        topics = TopicRenderer(self.topic_base, self.constants, self.topic_cache_size)
+
+        self.latency = metrics.Histogram("publish latency")
+        self.in_flight = {}  # mid -> list of measure-side send times of the readings in that message
+        self.published_early = {}  # mid -> publish time, for messages written out before publish() returned
+        self.in_flight_lock = threading.Lock()
+        self.next_latency_report = time.time() + self.latency_report_interval
+
+        if self.buffer_conf.get('enabled', False):
+            self.buffer = DiskBuffer(self.buffer_conf.get('path', '/app/data/buffer'),
+                                     int(self.buffer_conf.get('max_bytes', 50_000_000)),
+                                     int(self.buffer_conf.get('segment_bytes', 1_000_000)))
 
         client = mqtt.Client()
-        # client.on_connect = self.on_connect
+        client.on_connect = self.on_connect
         # client.on_message = self.on_message
         client.on_disconnect = self.on_disconnect
+        client.on_publish = self.on_publish
 
         # self.client.tls_set('ca.cert.pem',tls_version=2)
-        logger.info(f'connecting to {self.url}:{self.port}')
-        self.mqtt_connect(client, True)
+        logger.info('connecting to %s:%s', self.url, self.port)
+        if self.threaded:
+            # the network thread makes the first connection too, retrying with backoff
+            client.reconnect_delay_set(min_delay=self.initial, max_delay=self.limit)
+            client.connect_async(self.url, self.port, 60)
+            client.loop_start()
+        else:
+            self.mqtt_connect(client, True)
+
+        batching = self.batch_max_messages > 1
+        batch = {}  # topic -> (list of payloads, list of send times)
+        batch_size = 0
+        batch_deadline = None
 
         run = True
         while run:
-            while self.zmq_in.poll(50, zmq.POLLIN):
+            # threaded: MQTT is serviced by its own thread so block on ZMQ until a message (or the batch linger) is due
+            # poll: alternate between ZMQ and client.loop in 50ms slices
+            poll_timeout = None if self.threaded else 50
+            if self.has_buffered() and not self.connected:
+                poll_timeout = min(poll_timeout or 1000, 1000)  # check back for a reconnect to start the replay
+            for deadline in (batch_deadline, self.next_replay if self.connected and self.has_buffered() else None):
+                if deadline is not None:
+                    wait = max(0, int((deadline - time.monotonic()) * 1000))
+                    poll_timeout = wait if poll_timeout is None else min(poll_timeout, wait)
+            while self.zmq_in.poll(poll_timeout, zmq.POLLIN):
                 try:
                     msg = self.zmq_in.recv(zmq.NOBLOCK)
-                    msg_json = json.loads(msg)
-                    msg_path = msg_json['path']
-                    msg_payload = msg_json['payload']
-                    topic = chevron.render(urljoin(self.topic_base, msg_path), {**msg_payload, **self.constants})
-                    logger.debug(f'pub topic:{topic} msg:{msg_payload}')
-                    client.publish(topic, json.dumps(msg_payload))
+                    if self.health is not None:
+                        self.health.message_received()
+                    msg_decoded = self.codec.decode(msg)
+                    msg_path = msg_decoded['path']
+                    msg_payload = msg_decoded['payload']
+                    sent = msg_decoded.get('sent')
+                    topic = topics.render(msg_path, msg_payload)
+                    if batching:
+                        payloads, sent_times = batch.setdefault(topic, ([], []))
+                        payloads.append(msg_payload)
+                        if sent:
+                            sent_times.append(sent)
+                        batch_size += 1
+                        if batch_deadline is None:
+                            batch_deadline = time.monotonic() + self.batch_max_linger
+                        if batch_size >= self.batch_max_messages:
+                            break
+                    else:
+                        logger.debug('pub topic:%s msg:%s', topic, msg_payload)
+                        self.publish(client, topic, json.dumps(msg_payload), [sent] if sent else None)
                 except zmq.ZMQError:
                     pass
-            client.loop(0.05)
+                poll_timeout = 0  # drain whatever is already queued, then go back to servicing MQTT
+
+            if batch_size and (batch_size >= self.batch_max_messages or time.monotonic() >= batch_deadline):
+                self.publish_batch(client, batch)
+                batch = {}
+                batch_size = 0
+                batch_deadline = None
+            if self.connected and self.has_buffered():
+                self.replay(client)
+            if not self.threaded:
+                if self.next_connect is not None and time.monotonic() >= self.next_connect:
+                    self.mqtt_connect(client)
+                if self.connected or self.next_connect is None:
+                    client.loop(0.05)
+
+    def publish_batch(self, client, batch):
+        for topic, (payloads, sent_times) in batch.items():
+            logger.debug('pub topic:%s batch of %s', topic, len(payloads))
+            self.publish(client, topic, json.dumps(payloads), sent_times)